@@ -1,4 +1,5 @@
 #!/bin/env python3
+import copy
 import json
 import os.path
 from typing import Any, Tuple
@@ -10,14 +11,43 @@ from rich.prompt import Prompt
 from rich.table import Table
 
 from ovos_config import Configuration, LocalConf
+from ovos_config.index import KeyPathIndex
 from ovos_config.locations import USER_CONFIG
 
-CONFIG = Configuration()
-CONFIGS = [("Joined", CONFIG),
-           ("Sytem", CONFIG.system),
-           ("User", LocalConf(USER_CONFIG)),
-           ("Remote", CONFIG.remote)]
-SECTIONS = [k for k, v in CONFIG.items() if isinstance(v, dict)] + ["base"]
+# names of the configurations the CLI can show, in the order CONFIGS lists them
+CONFIG_NAMES = ["Joined", "Sytem", "User", "Remote"]
+
+
+def getConfig(name: str) -> dict:
+    """Load one of the configurations listed in CONFIG_NAMES
+
+    Nothing is loaded at import, each subcommand only loads the
+    configurations it uses
+    """
+    if name == "Joined":
+        return Configuration()
+    if name == "Sytem":
+        return Configuration.system
+    if name == "User":
+        return LocalConf(USER_CONFIG)
+    if name == "Remote":
+        return Configuration.remote
+    raise ValueError(f"unknown configuration: {name}")
+
+
+def getSections() -> list:
+    return [k for k, v in Configuration().items() if isinstance(v, dict)] + ["base"]
+
+
+def __getattr__(name: str):
+    # backwards compatibility, these used to be loaded at import
+    if name == "CONFIG":
+        return Configuration()
+    if name == "CONFIGS":
+        return [(n, getConfig(n)) for n in CONFIG_NAMES]
+    if name == "SECTIONS":
+        return getSections()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def drawTable(dic: dict, table: Table, level: int = 0) -> None:
@@ -51,36 +81,12 @@ def walkDict(dic: dict, key: str, only_endpoints: bool = False):
         Tuple of (path, value) for each matching key
         For backwards compatibility, 'path' has no leading slash.
     """
-    yield from _walkDict(dic,
-                         (key[1:] if key.startswith("/") else key).split("/"),
-                         key.startswith("/"),
-                         only_endpoints)
-
-def pathMatches(key: Tuple, path: Tuple, key_absolute: bool) -> bool:
-    if key_absolute and len(path) != len(key):
-        return False
-
-    if len(path) < len(key):
-        return False
-
-    return all(key_part.lower() in path_part.lower() for (key_part, path_part) in zip(key, path[-len(key):]))
-
-def _walkDict(dic: dict,
-              key: Tuple,
-              key_absolute: bool,
-              only_endpoints: bool = False,
-              path: Tuple = ()):
-    for k in dic:
-        if not (only_endpoints and isinstance(dic[k], dict)) and \
-                   pathMatches(key, path + (k,), key_absolute):
-            yield "/".join(path + (k,)), dic[k]
-
-        if isinstance(dic[k], dict):
-            yield from _walkDict(dic[k],
-                                 key,
-                                 key_absolute,
-                                 only_endpoints,
-                                 path + (k,))
+    if isinstance(dic, Configuration):
+        # reuse the index of the merged config
+        index = Configuration.get_key_index()
+    else:
+        index = KeyPathIndex(dic)
+    yield from index.search(key, only_endpoints)
 
 
 def pathGet(dic: dict, path: str) -> Any:
@@ -346,13 +352,14 @@ def show(user, system, remote, section, list_sections):
     \b
     """
     if not any([user, system, remote]):
-        name, config = CONFIGS[0]
+        name = CONFIG_NAMES[0]
     elif system:
-        name, config = CONFIGS[1]
+        name = CONFIG_NAMES[1]
     elif user:
-        name, config = CONFIGS[2]
+        name = CONFIG_NAMES[2]
     elif remote:
-        name, config = CONFIGS[3]
+        name = CONFIG_NAMES[3]
+    config = getConfig(name)
 
     # based on chosen configuration
     if name != "Joined":
@@ -360,22 +367,24 @@ def show(user, system, remote, section, list_sections):
         if [k for k, v in config.items() if not isinstance(v, dict)]:
             _sections.append("base")
     else:
-        _sections = SECTIONS
+        _sections = sections = getSections()
 
     if list_sections:
         console.print(f"Available sections ({name} config): " + " ".join(_sections))
         exit()
 
     if section:
+        if name != "Joined":
+            sections = getSections()
         # general info that no such key exists
-        if section not in SECTIONS:
+        if section not in sections:
             console.print(f"The section `{section}` doesn't exist. Please chose"
-                          f" from {' '.join(SECTIONS)}")
+                          f" from {' '.join(sections)}")
             exit()
         # based on chosen configuration
         elif section not in _sections:
-            found_in = [f"`{_name}`" for _name, _config in CONFIGS
-                        if section in _config and _name != name]
+            found_in = [f"`{_name}`" for _name in CONFIG_NAMES
+                        if _name != name and section in getConfig(_name)]
             console.print(f"The section `{section}` doesn't exist in the {name} "
                           f"Configuration. It is part of the {'/'.join(found_in)} "
                           "Configuration though")
@@ -414,7 +423,7 @@ def get(key):
     ovos-config get -k lang                              # get all lang key values across the configuration
     ovos-config get -k /tts/module                       # get the key at the position specified
     """
-    values = list(walkDict(CONFIG, key))
+    values = list(walkDict(Configuration(), key))
     if not values:
         console.print(f"No key with the name {key} found")
     else:
@@ -424,22 +433,38 @@ def get(key):
 
 
 @config.command()
-@click.option("--key", "-k", required=True, help="the key (or parts thereof) which should be searched")
+@click.option("--key", "-k", help="the key (or parts thereof) which should be searched")
 @click.option("--value", "-v", help="value the key should get associated with")
-def set(key, value):
+@click.option("--file", "-f", "patch_file", type=click.File("r"),
+              help="JSON/YAML patch or `path=value` lines to apply, `-` reads stdin")
+@click.argument("pairs", nargs=-1)
+def set(key, value, patch_file, pairs):
     """\b
     Sets a config key in the user configuration
     \b
     Loosely searches a config key and if multiple are found asks which key and value should be written.
     The user may pass a value to bypass prompting.
     \b
+    Many keys can be set at once by passing `path=value` pairs, a patch file or both.
+    Paths are absolute, values are cast to the type of the current value and the user configuration is only written once.
+    \b
     Examples: 
     ovos-config set -k gui                              # lists all config keys containing "gui" (either as endpoint or in path),
                                                         # let the user choose the specific key and asks for the value
     ovos-config set -k blacklisted_skills -v myskill    # Adds "myskill" as an blacklisted skill
                                                         # Since this is a pretty specific key and a value is passed, the user won't be prompted
+    ovos-config set lang=pt-PT tts/module=ovos-tts-plugin-server   # sets both keys with a single write
+    ovos-config set -f patch.yaml                       # merges a JSON/YAML patch into the user configuration
     """
-    tuples = list(walkDict(CONFIG, key, only_endpoints=True))
+    if pairs or patch_file:
+        if key or value:
+            raise click.UsageError("Pass either --key/--value or `path=value` pairs and --file, not both")
+        setMany(list(pairs), patch_file)
+        return
+    if not key:
+        raise click.UsageError("Missing option '--key' / '-k'")
+
+    tuples = list(walkDict(Configuration(), key, only_endpoints=True))
     values = [tup[1] for tup in tuples]
     paths = [tup[0] for tup in tuples]
 
@@ -477,39 +502,139 @@ def set(key, value):
                             f"(type: [red]{selected_type}[/red]) "))
         value = value.replace('"', '').replace("'", "").replace("`", "")
 
-    local_conf = CONFIGS[2][1]
-    _value = None
+    local_conf = getConfig("User")
     # type checking/casting
     try:
-        if isinstance(selected_value, str):
-            _value = value
-        elif isinstance(selected_value, bool):
-            if value in ["true", "True", "1", "on"]:
-                _value = True
-            elif value in ["false", "False", "0", "off"]:
-                _value = False
-            else:
-                raise TypeError
-        elif isinstance(selected_value, list):
-            try:
-                _value = pathGet(local_conf, selected_path)
-            except KeyError:
-                _value = list()
-                console.print(("Note: defining lists in the user config "
-                               "will override subsequent list configurations"),
-                              style="grey53")
-            _value.append(value)
-        elif isinstance(selected_value, int):
-            _value = int(value)
-        elif isinstance(selected_value, float):
-            _value = float(value)
+        if isinstance(selected_value, list):
+            _value = appendValue(local_conf, selected_path, value)
+        else:
+            _value = castValue(value, selected_value)
     except (TypeError, ValueError):
         console.print(f"[red]Error:[/red] The value passed can't be cast into {selected_type}")
         exit()
 
+    checkPath(local_conf, selected_path)
     pathSet(local_conf, selected_path, _value)
     local_conf.store()
 
 
+def castValue(value: str, reference: Any = None) -> Any:
+    """Cast a value given as string to the type of `reference`
+
+    Values of unknown keys and containers are parsed as JSON if possible
+    Raises TypeError or ValueError if the value can't be cast
+    """
+    if isinstance(reference, bool):
+        if value in ["true", "True", "1", "on"]:
+            return True
+        if value in ["false", "False", "0", "off"]:
+            return False
+        raise TypeError
+    if isinstance(reference, str):
+        return value
+    if isinstance(reference, int):
+        return int(value)
+    if isinstance(reference, float):
+        return float(value)
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def appendValue(local_conf: dict, path: str, value: Any) -> list:
+    """Get the list at `path` of the user config with `value` appended"""
+    try:
+        _value = list(pathGet(local_conf, path))
+    except KeyError:
+        _value = list()
+        console.print(("Note: defining lists in the user config "
+                       "will override subsequent list configurations"),
+                      style="grey53")
+    _value.append(value)
+    return _value
+
+
+def readPatch(patch_file) -> Tuple[dict, list]:
+    """Read a JSON/YAML patch or `path=value` lines
+
+    Returns:
+        Tuple of (patch, pairs), one of them is empty
+    """
+    content = patch_file.read()
+    try:
+        patch = json.loads(content)
+    except ValueError:
+        import yaml
+        try:
+            patch = yaml.safe_load(content)
+        except yaml.YAMLError:
+            patch = None
+    if isinstance(patch, dict):
+        return patch, []
+    pairs = [line.strip() for line in content.splitlines()
+             if line.strip() and not line.strip().startswith("#")]
+    return {}, pairs
+
+
+def checkPath(dic: dict, path: str) -> None:
+    """Raise click.BadParameter if a key along `path` holds a value, not a section"""
+    _path = path.lstrip("/").split("/")[:-1]
+    for idx, entry in enumerate(_path):
+        dic = dic.get(entry)
+        if dic is None:
+            return
+        if not isinstance(dic, dict):
+            raise click.BadParameter(f"`/{'/'.join(_path[:idx + 1])}` is not a "
+                                     f"section, can't set `/{path}`")
+
+
+def setMany(pairs: list, patch_file=None) -> LocalConf:
+    """Apply many `path=value` pairs and a patch to the user configuration
+
+    The changes are applied to a copy of the user configuration first, the
+    user configuration is only modified and written once every value was
+    cast and every path checked. Nothing is written if any is invalid
+    """
+    patch = {}
+    if patch_file:
+        patch, file_pairs = readPatch(patch_file)
+        pairs = file_pairs + pairs
+
+    updates = []
+    for pair in pairs:
+        path, sep, value = pair.partition("=")
+        path = path.strip().strip("/")
+        if not sep or not path:
+            raise click.UsageError(f"Expected `path=value`, got `{pair}`")
+        updates.append((path, value.strip(), Configuration.get_path(path)))
+
+    local_conf = getConfig("User")
+    staged = LocalConf(None)
+    staged.update(copy.deepcopy(dict(local_conf)))
+    if patch:
+        staged.merge(patch)
+    for path, value, reference in updates:
+        checkPath(staged, path)
+        try:
+            if isinstance(reference, list) and not value.startswith("["):
+                _value = appendValue(staged, path, value)
+            else:
+                _value = castValue(value, reference)
+        except (TypeError, ValueError):
+            raise click.BadParameter(f"`{value}` can't be cast into "
+                                     f"{reference.__class__.__name__} for `{path}`")
+        pathSet(staged, path, _value)
+
+    for key, value in staged.items():
+        if key not in local_conf or local_conf[key] != value:
+            local_conf[key] = value
+    for path, value, _ in updates:
+        console.print(f"Set [red]/{path}[/red] to [red]{pathGet(local_conf, path)}[/red]")
+    local_conf.store()
+    console.print(f"Config updated: {local_conf.path}")
+    return local_conf
+
+
 if __name__ == "__main__":
     config()
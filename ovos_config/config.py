@@ -12,42 +12,247 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import hashlib
+import itertools
 import json
-from os.path import isfile
-from typing import Optional
+import os
+from dataclasses import dataclass, field
+from os.path import isfile, join
+from threading import Lock, RLock, Timer
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, \
+    NamedTuple, Optional
 
 from ovos_config.models import LocalConf, MycroftDefaultConfig, \
     OvosDistributionConfig, MycroftSystemConfig, MycroftUserConfig, \
     RemoteConf
+from ovos_config.diff import ConfigChange, diff_configs, filter_changes
+from ovos_config.dispatch import CallbackDispatcher
+from ovos_config.frozen import FrozenDict, freeze
+from ovos_config.index import KeyPathIndex
+from ovos_config.merge import LayeredMerge, compile_key_paths, merge_layer
+from ovos_config.shared import SharedSnapshot, shared_snapshot_enabled
 from ovos_config.locations import OLD_USER_CONFIG, get_xdg_config_save_path, \
-    get_xdg_config_locations
-from ovos_utils.file_utils import FileWatcher
+    get_xdg_config_locations, get_xdg_runtime_save_path, DEFAULT_CONFIG, \
+    DISTRIBUTION_CONFIG, SYSTEM_CONFIG, WEB_CONFIG_CACHE
 
-from ovos_utils.json_helper import flattened_delete, merge_dict
 from ovos_utils.log import LOG
 
 
+@dataclass(frozen=True)
+class SystemConstraints:
+    """
+    Resolved system constraints limiting how config layers are merged,
+    see Configuration.get_constraints()
+    """
+    disable_user_config: bool = False
+    disable_remote_config: bool = False
+    # tries of protected keys as returned by compile_key_paths
+    protected_remote: dict = field(default_factory=dict)
+    protected_user: dict = field(default_factory=dict)
+    # the "system" config section the constraints were resolved from
+    config: dict = field(default_factory=dict)
 
-class Configuration(dict):
+    @staticmethod
+    def from_dict(system_conf: dict) -> "SystemConstraints":
+        """
+        Resolve the system constraints from a "system" config section
+        @param system_conf: dict of system configuration constraints
+        @return: resolved constraints
+        """
+        protected_keys = system_conf.get("protected_keys") or {}
+        return SystemConstraints(
+            disable_user_config=bool(system_conf.get("disable_user_config")),
+            disable_remote_config=bool(
+                system_conf.get("disable_remote_config")),
+            protected_remote=compile_key_paths(
+                tuple(protected_keys.get("remote") or [])),
+            protected_user=compile_key_paths(
+                tuple(protected_keys.get("user") or [])),
+            config=system_conf)
+
+    def is_enabled(self, kind: str) -> bool:
+        """
+        Check if a kind of config layer may be merged
+        @param kind: "system", "remote" or "user"
+        @return: False if layers of this kind are disabled
+        """
+        if kind == "remote" and self.disable_remote_config:
+            return False
+        # remote config is also user provided
+        if kind in ("remote", "user") and self.disable_user_config:
+            return False
+        return True
+
+    def get_protected_keys(self, kind: str) -> dict:
+        """
+        Get the keys a kind of config layer is not allowed to set
+        @param kind: "system", "remote" or "user"
+        @return: trie of protected keys
+        """
+        if kind == "remote":
+            return self.protected_remote
+        if kind == "user":
+            return self.protected_user
+        return {}
+
+
+@dataclass(frozen=True, eq=False)
+class ConfigLayer:
+    """
+    Describes a config layer taking part in a merge. The layer contents are
+    referenced, not copied, and are never modified by the merge
+    """
+    config: dict = field(repr=False)
+    path: Optional[str] = None
+    # "system", "remote" or "user", see SystemConstraints
+    kind: str = "user"
+    # nested dicts of read only layers are shared with the merged result
+    read_only: bool = False
+
+
+# marks key paths not set in the merged config, see Configuration.get_path()
+_MISSING = object()
+
+
+def _get_env_float(name: str, default: float) -> float:
+    """ read a number from an environment variable """
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        LOG.warning(f"{name} is not a number, using {default}")
+        return default
+
+
+# source of Configuration._layer_changes, next() on it is atomic
+_layer_counter = itertools.count(1)
+# class attributes holding config layers, see _ConfigurationType
+_LAYER_ATTRIBUTES = frozenset(("default", "distribution", "system", "remote",
+                               "xdg_configs", "_Configuration__patch"))
+
+
+class _ConfigurationType(type):
+    """
+    Metaclass of Configuration, counts the replacements of its config layers.
+    Layers are replaced as a whole, the xdg_configs list is not modified in
+    place
+    """
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if name in _LAYER_ATTRIBUTES:
+            type.__setattr__(cls, "_layer_changes", next(_layer_counter))
+
+
+class _Published(NamedTuple):
+    """
+    Merged configuration published to readers. Replaced as a whole when a
+    layer changes, so a reader never sees a state and a merge that do not
+    belong together
+    """
+    state: Any
+    merged: Optional[dict]
+    # kept referenced so their ids, part of `state`, are not reused
+    layers: Any
+    # incremented every time a new merge is published
+    generation: int = 0
+    # Configuration._get_change_token() when published, None for merges
+    # of a shared snapshot, which are checked on every read
+    token: Any = None
+
+
+class _LazyLayer:
+    """
+    Class attribute holding a config layer that is only loaded on first access.
+    Once loaded the descriptor replaces itself with the loaded value
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = RLock()
+        self._owner = None
+        self._name = None
+
+    def __set_name__(self, owner, name):
+        self._owner = owner
+        self._name = name
+
+    def __get__(self, instance, owner=None):
+        with self._lock:
+            value = self._owner.__dict__.get(self._name)
+            if value is self:
+                value = self._factory()
+                setattr(self._owner, self._name, value)
+        return value
+
+
+class Configuration(dict, metaclass=_ConfigurationType):
     """Namespace for operations on the configuration singleton."""
     __patch = LocalConf(None)  # Patch config that skills can update to override config
     bus = None
-    default = MycroftDefaultConfig()
-    distribution = OvosDistributionConfig()
-    system = MycroftSystemConfig()
-    remote = RemoteConf()
+    # config files are only read the first time each layer is accessed
+    default = _LazyLayer(MycroftDefaultConfig)
+    distribution = _LazyLayer(OvosDistributionConfig)
+    system = _LazyLayer(MycroftSystemConfig)
+    remote = _LazyLayer(RemoteConf)
     # This includes both the user config and
     # /etc/xdg/mycroft/mycroft.conf
-    xdg_configs = [LocalConf(p) for p in get_xdg_config_locations()]
+    xdg_configs = _LazyLayer(
+        lambda: [LocalConf(p) for p in get_xdg_config_locations()])
     _watchdog = None
     _callbacks = []
+    # (callback, key path prefixes) notified with the changes, see subscribe()
+    _subscribers = []
+    # file change events are collected for this many seconds and handled
+    # together, None reads OVOS_CONFIG_WATCH_DEBOUNCE (default 0.1)
+    _debounce = None
+    _pending_changes = set()
+    _pending_timer = None
+    _pending_lock = Lock()
+    _file_event_stats = {"received": 0, "suppressed": 0, "handled": 0}
+    # runs the change callbacks, see _get_dispatcher()
+    _dispatcher = None
+    # merged snapshot of the config stack, rebuilt only when a layer changes
+    # copy of _published.generation, read that instead to get the matching
+    # merged config
+    generation = 0
+    # readers only load this attribute, writers serialize on _merged_lock
+    # and publish a new _Published when done (read-copy-update)
+    _published = _Published(None, None, None)
+    _merged_lock = RLock()
+    # serializes the copy-on-write updates of the runtime patch
+    _patch_lock = Lock()
+    # changes whenever a layer is replaced, see _get_change_token()
+    _layer_changes = 0
+    # OVOS_CONFIG_SHARED_SNAPSHOT, read once per reload()
+    _shared_enabled = None
+    _layered_merge = LayeredMerge()
+    # merged config shared between processes, see OVOS_CONFIG_SHARED_SNAPSHOT
+    _shared = None
+    _shared_checked = False
+    # resolved system constraints and the layer states they came from
+    _constraints = (None, None)
+    # merged config, its immutable view and the freeze memo, see snapshot()
+    _frozen = (None, None, {})
+    # merged config and the key paths resolved against it, see get_path()
+    _path_memo = (None, {})
+    # merged config and its key path index, see get_key_index()
+    _key_index = (None, None)
 
     def __init__(self):
-        super().__init__(**self.load_all_configs())
+        published = Configuration._get_published()
+        super().__init__(**published.merged)
+        self._generation = published.generation
+
+    def _sync(self):
+        """refresh this instance from the merged snapshot if any layer changed"""
+        published = Configuration._get_published()
+        if self._generation != published.generation:
+            super().update(published.merged)
+            self._generation = published.generation
 
     # dict methods
     def __setitem__(self, key, value):
-        Configuration.__patch[key] = value
+        Configuration._update_patch({key: value})
         super().__setitem__(key, value)
         # sync with other processes connected to bus
         if Configuration.bus:
@@ -57,30 +262,30 @@ class Configuration(dict):
                                            {"config": {key: value}}))
 
     def __getitem__(self, item):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         return super().get(item)
 
     def __str__(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         try:
             return json.dumps(self, sort_keys=True)
         except:
             return super().__str__()
 
     def __dict__(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         return self
 
     def __repr__(self):
         return self.__str__()
 
     def __iter__(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         for k in super().__iter__():
             yield k
 
     def update(self, *args, **kwargs):
-        Configuration.__patch.update(*args, **kwargs)
+        Configuration._update_patch(dict(*args, **kwargs))
         super().update(*args, **kwargs)
 
     def pop(self, key):
@@ -91,18 +296,115 @@ class Configuration(dict):
         self.__setitem__(key, None)
 
     def items(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         return super().items()
 
     def keys(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         return super().keys()
 
     def values(self):
-        super().update(Configuration.load_all_configs())
+        self._sync()
         return super().values()
 
     # config methods
+    @staticmethod
+    def snapshot() -> FrozenDict:
+        """
+        Get an immutable, hashable view of the merged configuration.
+        The same object is returned until the configuration changes, so it
+        can be shared between threads without copying and compared by
+        identity to detect changes. Nested sections that did not change are
+        also the same objects across snapshots
+        @return: merged configuration with dicts frozen and lists as tuples
+        """
+        merged = Configuration._get_merged()
+        source, frozen, _ = Configuration._frozen
+        if source is merged:
+            return frozen
+        with Configuration._merged_lock:
+            source, frozen, previous = Configuration._frozen
+            if source is not merged:
+                memo = {}
+                frozen = freeze(merged, previous, memo)
+                Configuration._frozen = (merged, frozen, memo)
+        return frozen
+
+    @staticmethod
+    def get_path(path: str, default: Any = None,
+                 coerce: Optional[Callable[[Any], Any]] = None,
+                 separator: str = "/") -> Any:
+        """
+        Get a nested config value by its key path, eg. "tts/module".
+        Resolved paths are cached until the configuration changes
+        @param path: keys separated by `separator`
+        @param default: value returned if the path is not set
+        @param coerce: optional type or callable to convert the value with,
+            `default` is returned if the conversion fails
+        @param separator: separator between the keys of `path`
+        @return: config value, nested dicts are shared and must not be modified
+        """
+        merged = Configuration._get_merged()
+        source, memo = Configuration._path_memo
+        if source is not merged:
+            memo = {}
+            Configuration._path_memo = (merged, memo)
+        key = (path, separator)
+        try:
+            value = memo[key]
+        except KeyError:
+            value = merged
+            for k in path.split(separator):
+                if not isinstance(value, dict) or k not in value:
+                    value = _MISSING
+                    break
+                value = value[k]
+            memo[key] = value
+        if value is _MISSING:
+            return default
+        if coerce is not None and not (isinstance(coerce, type) and
+                                       isinstance(value, coerce)):
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError):
+                LOG.warning(f"config value '{path}' is not a valid {coerce}")
+                return default
+        return value
+
+    @staticmethod
+    def get_many(paths: Iterable[str], defaults: Optional[dict] = None,
+                 coerce: Optional[Dict[str, Callable[[Any], Any]]] = None,
+                 separator: str = "/") -> dict:
+        """
+        Get several nested config values by their key paths, see get_path()
+        @param paths: key paths to resolve
+        @param defaults: optional dict of path -> value returned if not set
+        @param coerce: optional dict of path -> type or callable to convert
+            the value with
+        @param separator: separator between the keys of each path
+        @return: dict of path -> config value
+        """
+        defaults = defaults or {}
+        coerce = coerce or {}
+        return {path: Configuration.get_path(path, defaults.get(path),
+                                             coerce.get(path), separator)
+                for path in paths}
+
+    @staticmethod
+    def get_key_index() -> KeyPathIndex:
+        """
+        Get an index of every key path in the merged configuration, for
+        searching keys without walking the whole tree.
+        The index is built once per configuration change
+        @return: KeyPathIndex of the merged configuration
+        """
+        merged = Configuration._get_merged()
+        source, index = Configuration._key_index
+        if source is not merged:
+            index = KeyPathIndex(merged)
+            Configuration._key_index = (merged, index)
+        return index
+
     @staticmethod
     def load_config_stack(configs=None, cache=False, remote=True):
         """Load a stack of config dicts into a single dict
@@ -128,7 +430,8 @@ class Configuration(dict):
         """
         Remove any configuration patches and reload configuration
         """
-        Configuration.__patch = {}
+        with Configuration._patch_lock:
+            Configuration.__patch = LocalConf(None)
         Configuration.reload()
 
     @staticmethod
@@ -136,12 +439,59 @@ class Configuration(dict):
         """
         Reload all configuration files
         """
-        Configuration.default.reload()
-        Configuration.system.reload()
-        Configuration.remote.reload()
-        for cfg in Configuration.xdg_configs:
+        Configuration._shared_enabled = None
+        # layers not loaded yet will read the files on first access
+        for name in ("default", "system", "remote"):
+            cfg = Configuration._get_loaded_layer(name)
+            if cfg is not None:
+                cfg.reload()
+        for cfg in Configuration._get_loaded_layer("xdg_configs") or []:
             cfg.reload()
 
+    @staticmethod
+    async def areload():
+        """
+        Reload all configuration files without blocking the event loop, the
+        files are read and merged in the loop's default executor
+        """
+        import asyncio
+
+        def _reload():
+            Configuration.reload()
+            Configuration._get_merged()
+
+        await asyncio.get_running_loop().run_in_executor(None, _reload)
+
+    @staticmethod
+    async def watch(prefixes: Optional[Iterable[str]] = None
+                    ) -> AsyncIterator[ConfigChange]:
+        """
+        Watch the config files and iterate over the key paths that change
+        in the merged configuration, see subscribe()
+        eg. `async for change in Configuration.watch(["listener"]):`
+        @param prefixes: optional key paths, only changes affecting them
+            are yielded
+        @return: async iterator of ConfigChange
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def _on_change(changes: List[ConfigChange]):
+            # called from the callback thread pool
+            try:
+                for change in changes:
+                    loop.call_soon_threadsafe(queue.put_nowait, change)
+            except RuntimeError:
+                pass  # event loop already closed
+
+        Configuration.subscribe(_on_change, prefixes)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            Configuration.unsubscribe(_on_change)
+
     @staticmethod
     def get_system_constraints() -> dict:
         """
@@ -150,11 +500,291 @@ class Configuration(dict):
         These settings can not be set anywhere else!
         @return: dict of system configuration constraints
         """
+        return dict(Configuration.get_constraints().config)
+
+    @staticmethod
+    def _get_constraints_state() -> tuple:
+        """
+        Get a token that changes whenever a layer defining the system
+        constraints is replaced or modified
+        """
+        return (id(Configuration.default), id(Configuration.system),
+                id(Configuration.distribution),
+                getattr(Configuration.default, "revision", None),
+                getattr(Configuration.system, "revision", None),
+                getattr(Configuration.distribution, "revision", None))
+
+    @staticmethod
+    def get_constraints() -> SystemConstraints:
+        """
+        Get the resolved system constraints, cached until the default,
+        distribution or system config change
+        @return: system configuration constraints
+        """
+        state = Configuration._get_constraints_state()
+        cached_state, constraints = Configuration._constraints
+        if state != cached_state:
+            system_conf = Configuration.distribution.get("system") or \
+                Configuration.system.get("system") or \
+                Configuration.default.get("system") or \
+                {}
+            constraints = SystemConstraints.from_dict(system_conf)
+            Configuration._constraints = (state, constraints)
+        return constraints
+
+    @staticmethod
+    def _get_loaded_layer(name: str):
+        """
+        Get a config layer without loading it
+        @param name: layer attribute name, eg. "default" or "xdg_configs"
+        @return: the layer, None if it was not loaded yet
+        """
+        layer = vars(Configuration).get(name)
+        return None if isinstance(layer, _LazyLayer) else layer
+
+    @staticmethod
+    def _get_layer_files() -> list:
+        """
+        Get the config files of the stack without loading any layer
+        @return: list of (path, layer) tuples, layer is None if not loaded yet
+        """
+        files = []
+        for name, path in (("default", DEFAULT_CONFIG),
+                           ("remote", WEB_CONFIG_CACHE),
+                           ("distribution", DISTRIBUTION_CONFIG),
+                           ("system", SYSTEM_CONFIG)):
+            cfg = Configuration._get_loaded_layer(name)
+            files.append((path, None) if cfg is None else (cfg.path, cfg))
+        xdg_configs = Configuration._get_loaded_layer("xdg_configs")
+        if xdg_configs is None:
+            files += [(path, None) for path in get_xdg_config_locations()]
+        else:
+            files += [(cfg.path, cfg) for cfg in xdg_configs]
+        return files
+
+    @staticmethod
+    def _get_stack_key() -> bytes:
+        """
+        Get a digest identifying the contents of every config file in the stack
+        Loaded layers use the signature of the file when it was last loaded
+        @return: 16 bytes digest
+        """
+        key = hashlib.blake2b(digest_size=16)
+        for path, cfg in Configuration._get_layer_files():
+            if cfg is None:
+                signature = LocalConf._get_file_signature(path)
+            else:
+                signature = getattr(cfg, "_last_signature", None)
+            key.update(repr((path, signature)).encode("utf-8"))
+        return key.digest()
+
+    @staticmethod
+    def _get_shared_snapshot() -> SharedSnapshot:
+        """
+        Get the snapshot file shared by all processes using this config stack
+        """
+        if Configuration._shared is None:
+            paths = [path for path, _ in Configuration._get_layer_files()]
+            name = hashlib.blake2b("\n".join(paths).encode("utf-8"),
+                                   digest_size=8).hexdigest()
+            Configuration._shared = SharedSnapshot(
+                join(get_xdg_runtime_save_path(), f"config_{name}.snapshot"))
+        return Configuration._shared
+
+    @staticmethod
+    def _get_shared_published() -> Optional[_Published]:
+        """
+        Get the merged configuration published by another process.
+        Only used while this process did not load any config layer itself,
+        the runtime patch of this process is merged on top
+        @return: published merge of all configuration files, None if
+            unavailable
+        """
+        if not Configuration._shared_snapshot_enabled() or \
+                any(Configuration._get_loaded_layer(name) is not None
+                    for name in ("default", "remote", "distribution",
+                                 "system", "xdg_configs")):
+            return None
+        entry = Configuration._get_shared_snapshot().read()
+        if entry is None:
+            return None
+        key, data = entry
+        if not Configuration._shared_checked:
+            # the config files may have changed while no process watched them
+            if key != Configuration._get_stack_key():
+                LOG.debug("Shared configuration snapshot is outdated")
+                return None
+            Configuration._shared_checked = True
+
+        patch = Configuration.__patch
+        state = (id(data), id(patch), getattr(patch, "revision", None))
+        published = Configuration._published
+        if state == published.state:
+            return published
+        with Configuration._merged_lock:
+            constraints = SystemConstraints.from_dict(data["constraints"])
+            merged = data["config"]
+            if patch and constraints.is_enabled("user"):
+                merged = merge_layer(merged, patch,
+                                     constraints.get_protected_keys("user"))
+            return Configuration._publish(state, merged, [data, patch])
+
+    @staticmethod
+    def _publish(state: tuple, merged: dict, layers: list,
+                 token: Optional[tuple] = None) -> _Published:
+        """
+        Publish a new merge to readers, called with _merged_lock held
+        @param state: layer states `merged` was built from
+        @param merged: merged config
+        @param layers: layers `merged` was built from
+        @param token: change token taken before reading the layers
+        @return: the published merge
+        """
+        generation = Configuration._published.generation + 1
+        published = _Published(state, merged, layers, generation, token)
+        Configuration._published = published
+        Configuration.generation = generation
+        return published
+
+    @staticmethod
+    def _publish_shared_snapshot():
+        """
+        Share the merge of the config files loaded by this process with
+        other processes, see OVOS_CONFIG_SHARED_SNAPSHOT
+        """
+        Configuration._shared_checked = True
+        with Configuration._merged_lock:
+            Configuration._get_merged()
+            # every layer except the runtime patch of this process
+            config = Configuration._layered_merge.get_prefix(-2)
+            data = {"config": config,
+                    "constraints": Configuration.get_constraints().config}
+        try:
+            Configuration._get_shared_snapshot().write(
+                Configuration._get_stack_key(), data)
+        except Exception as e:
+            LOG.error(f"Failed to publish shared configuration: {e}")
+
+    @staticmethod
+    def _get_layers() -> list:
+        """
+        Get every config layer that may take part in the merge, in stack order
+        @return: list of config dicts
+        """
+        return [Configuration.default, Configuration.remote,
+                Configuration.distribution, Configuration.system] + \
+            Configuration.xdg_configs + [Configuration.__patch]
+
+    @staticmethod
+    def _get_layer_states(layers: list) -> tuple:
+        """
+        Get a token per layer that changes whenever that layer is modified
+        @param layers: config layers as returned by _get_layers
+        @return: tuple of hashable layer states
+        """
+        # every layer is filtered according to the system constraints, a
+        # change in the layers defining them invalidates the whole stack
+        constraints = Configuration._get_constraints_state()
+        # copies made by LocalConf.derive() continue the revisions of the
+        # layer they replace, their changed keys are still known
+        return tuple((id(getattr(cfg, "lineage", cfg)),
+                      getattr(cfg, "revision", None), constraints)
+                     for cfg in layers)
 
-        return Configuration.distribution.get("system") or \
-            Configuration.system.get("system") or \
-            Configuration.default.get("system") or \
-            {}
+    @staticmethod
+    def _get_merged() -> dict:
+        """
+        Get the cached merged configuration. Only the layers from the first
+        one replaced or modified since the last merge upwards are merged again
+        The returned dict is shared and must not be modified
+        @return: merged dict of all configuration files
+        """
+        return Configuration._get_published().merged
+
+    @staticmethod
+    def _get_change_token() -> tuple:
+        """
+        Get a token that changes whenever any LocalConf is modified or a
+        config layer is replaced. It may also change when no layer did,
+        eg. when a LocalConf outside the stack is modified
+        """
+        return LocalConf.changes, Configuration._layer_changes
+
+    @staticmethod
+    def _shared_snapshot_enabled() -> bool:
+        """ cached shared_snapshot_enabled(), read again by reload() """
+        enabled = Configuration._shared_enabled
+        if enabled is None:
+            enabled = Configuration._shared_enabled = shared_snapshot_enabled()
+        return enabled
+
+    @staticmethod
+    def _get_published() -> _Published:
+        """
+        Get the merged configuration and its generation, merging the layers
+        again if any changed. See _get_merged()
+        @return: published merge of all configuration files
+        """
+        token = Configuration._get_change_token()
+        published = Configuration._published
+        if token == published.token:
+            return published
+        shared = Configuration._get_shared_published()
+        if shared is not None:
+            return shared
+        with Configuration._merged_lock:
+            # loading a layer on first access replaces it, load them first
+            Configuration._get_layers()
+            # taken before looking at the layers, a change made while
+            # merging leaves the published token outdated
+            token = Configuration._get_change_token()
+            layers = Configuration._get_layers()
+            states = Configuration._get_layer_states(layers)
+            published = Configuration._published
+            if states == published.state:
+                # another writer merged while we waited for the lock, or
+                # the change did not affect the stack
+                if published.token != token:
+                    published = published._replace(token=token)
+                    Configuration._published = published
+                return published
+            constraints = Configuration.get_constraints()
+            descriptors = [Configuration.describe_layer(cfg)
+                           for cfg in layers]
+            merged = Configuration._layered_merge.update(
+                states,
+                lambda idx: descriptors[idx].config
+                if constraints.is_enabled(descriptors[idx].kind) else None,
+                lambda idx, old: Configuration._get_changed_keys(
+                    layers[idx], old, states[idx]),
+                lambda idx: constraints.get_protected_keys(
+                    descriptors[idx].kind),
+                lambda idx: descriptors[idx].read_only)
+            published = Configuration._publish(states, merged, layers, token)
+        if not Configuration._shared_checked and \
+                Configuration._shared_snapshot_enabled():
+            entry = Configuration._get_shared_snapshot().read()
+            if entry is None or entry[0] != Configuration._get_stack_key():
+                Configuration._publish_shared_snapshot()
+            Configuration._shared_checked = True
+        return published
+
+    @staticmethod
+    def _get_changed_keys(cfg: dict, old_state: tuple,
+                          new_state: tuple) -> Optional[set]:
+        """
+        Get the top level keys of a layer modified between two states
+        @param cfg: config layer
+        @param old_state: layer state at the previous merge
+        @param new_state: current layer state
+        @return: set of modified keys, or None if the whole layer must be merged
+        """
+        old_id, old_rev, old_constraints = old_state
+        new_id, _, new_constraints = new_state
+        if old_id != new_id or old_constraints != new_constraints or \
+                not isinstance(cfg, LocalConf):
+            return None
+        return cfg.changed_keys(old_rev)
 
     @staticmethod
     def load_all_configs(system_constraints: Optional[dict] = None) -> dict:
@@ -163,6 +793,17 @@ class Configuration(dict):
         @param system_constraints: constraints to limit user/remote config usage
         @return: merged dict of all configuration files
         """
+        if system_constraints is None:
+            return dict(Configuration._get_merged())
+        return Configuration._merge_stack(system_constraints)
+
+    @staticmethod
+    def _merge_stack(system_constraints: Optional[dict] = None) -> dict:
+        """
+        Merge the stack of config layers, bypassing the merged snapshot
+        @param system_constraints: constraints to limit user/remote config usage
+        @return: merged dict of all configuration files
+        """
         # system administrators can define different constraints in how
         # configurations are loaded
         system_constraints = system_constraints or \
@@ -186,45 +827,57 @@ class Configuration(dict):
     def filter_and_merge(configs) -> dict:
         """
         Build and return a configuration dict based on configuration files
-        @param configs: List of Configuration objects to load
+        @param configs: List of Configuration objects to load, file paths or
+            plain dicts are also accepted
         @return: dict Configuration, built from `configs`
         """
-        # ensure type
-        for index, item in enumerate(configs):
-            if isinstance(item, str):
-                configs[index] = LocalConf(item)
-            elif not isinstance(item, LocalConf):
-                configs[index] = LocalConf(None)
-                configs[index].merge(item)
-
         # system administrators can define different constraints in how
         # configurations are loaded
-        system_conf = Configuration.get_system_constraints()
-        protected_keys = system_conf.get("protected_keys") or {}
-        protected_remote = protected_keys.get("remote") or []
-        protected_user = protected_keys.get("user") or []
-        skip_user = system_conf.get("disable_user_config", False)
-        skip_remote = system_conf.get("disable_remote_config", False)
+        constraints = Configuration.get_constraints()
 
         # Merge all configs into one
         base = {}
         for cfg in configs:
-            is_user = cfg.path is None or cfg.path not in [Configuration.default.path,
-                                                           Configuration.system.path]
-            is_remote = cfg.path == Configuration.remote.path
-            if (is_remote and skip_remote) or (is_user and skip_user):
-                continue
-            elif is_remote:
-                # delete protected keys from remote config
-                for protection in protected_remote:
-                    flattened_delete(cfg, protection)
-            elif is_user:
-                # delete protected keys from user config
-                for protection in protected_user:
-                    flattened_delete(cfg, protection)
-            merge_dict(base, cfg)
+            layer = Configuration.describe_layer(cfg)
+            if constraints.is_enabled(layer.kind):
+                base = merge_layer(base, layer.config,
+                                   constraints.get_protected_keys(layer.kind),
+                                   share=layer.read_only)
         return base
 
+    @staticmethod
+    def describe_layer(cfg) -> ConfigLayer:
+        """
+        Get the descriptor of a config layer without copying its contents
+        @param cfg: LocalConf, plain dict or path to a config file
+        @return: layer descriptor
+        """
+        if isinstance(cfg, ConfigLayer):
+            return cfg
+        if isinstance(cfg, str):
+            cfg = LocalConf(cfg)
+        return ConfigLayer(cfg, getattr(cfg, "path", None),
+                           Configuration._get_layer_kind(cfg),
+                           not getattr(cfg, "allow_overwrite", True))
+
+    @staticmethod
+    def _get_layer_kind(cfg: dict) -> str:
+        """
+        Classify a config layer for the system constraints
+        @param cfg: config layer
+        @return: "system" for the default and system config, "remote" for the
+            remote config and "user" for everything else
+        """
+        path = getattr(cfg, "path", None)
+        if path is None:
+            # in memory config, eg. runtime patches
+            return "user"
+        if path == Configuration.remote.path:
+            return "remote"
+        if path in [Configuration.default.path, Configuration.system.path]:
+            return "system"
+        return "user"
+
     @staticmethod
     def set_config_update_handlers(bus):
         """
@@ -256,56 +909,220 @@ class Configuration(dict):
             pass
 
     @staticmethod
-    def set_config_watcher(callback: Optional[callable] = None):
+    def set_config_watcher(callback: Optional[callable] = None,
+                           debounce: Optional[float] = None):
         """
         Setup filewatcher to monitor for config file changes
         @param callback: optional method to call when configuration is changed
+        @param debounce: seconds to collect file change events for before
+            handling them together, 0 handles every event immediately.
+            Defaults to OVOS_CONFIG_WATCH_DEBOUNCE or 0.1
         """
-        paths = [Configuration.distribution.path, Configuration.system.path] + \
-                [c.path for c in Configuration.xdg_configs]
+        # distribution, system and xdg config files. layers are not loaded,
+        # processes reading a shared snapshot keep using it
+        paths = [path for path, _ in Configuration._get_layer_files()[2:]]
         if callback and callback not in Configuration._callbacks:
             Configuration._callbacks.append(callback)
+        if debounce is not None:
+            Configuration._debounce = debounce
         if not Configuration._watchdog:
+            # imported here to only load watchdog when it is needed
+            from ovos_utils.file_utils import FileWatcher
             Configuration._watchdog = FileWatcher(
                 [p for p in paths if isfile(p)],
-                Configuration._on_file_change
+                Configuration._on_file_event
             )
 
     @staticmethod
-    def _on_file_change(path: str):
+    def subscribe(callback: Callable[[List[ConfigChange]], None],
+                  prefixes: Optional[Iterable[str]] = None):
+        """
+        Watch the config files and call `callback` with the key paths that
+        changed in the merged configuration whenever a file is modified
+        @param callback: called with a list of ConfigChange
+        @param prefixes: optional key paths, eg. ["listener", "tts/module"],
+            the callback is only called for changes affecting them
+        """
+        Configuration.unsubscribe(callback)
+        Configuration._subscribers.append(
+            (callback, tuple(prefixes) if prefixes is not None else None))
+        Configuration.set_config_watcher()
+
+    @staticmethod
+    def unsubscribe(callback: Callable[[List[ConfigChange]], None]):
+        """
+        Stop notifying a callback registered with subscribe()
+        @param callback: method passed to subscribe()
+        """
+        Configuration._subscribers = [s for s in Configuration._subscribers
+                                      if s[0] != callback]
+
+    @staticmethod
+    def _get_debounce() -> float:
+        """ seconds file change events are collected for before handling """
+        if Configuration._debounce is not None:
+            return Configuration._debounce
+        return _get_env_float("OVOS_CONFIG_WATCH_DEBOUNCE", 0.1)
+
+    @staticmethod
+    def _get_dispatcher() -> CallbackDispatcher:
+        """
+        Get the thread pool running the change callbacks. Its size and the
+        time after which a callback is reported as slow are read from
+        OVOS_CONFIG_CALLBACK_WORKERS (default 4, 0 runs callbacks in the
+        watcher thread) and OVOS_CONFIG_CALLBACK_TIMEOUT (default 5 seconds)
+        """
+        with Configuration._pending_lock:
+            if Configuration._dispatcher is None:
+                Configuration._dispatcher = CallbackDispatcher(
+                    int(_get_env_float("OVOS_CONFIG_CALLBACK_WORKERS", 4)),
+                    _get_env_float("OVOS_CONFIG_CALLBACK_TIMEOUT", 5))
+            return Configuration._dispatcher
+
+    @staticmethod
+    def wait_for_callbacks(timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the change callbacks already dispatched to finish
+        @param timeout: maximum seconds to wait, None waits forever
+        @return: True if no callback is pending
+        """
+        return Configuration._get_dispatcher().wait(timeout)
+
+    @staticmethod
+    def get_callback_stats() -> dict:
+        """
+        Get latency metrics of the change callbacks
+        @return: dict of callback -> dict with the number of "calls",
+            "errors" and "timeouts" and the "total_latency" and
+            "max_latency" in seconds
         """
-        Callback method for FileWatcher
+        return Configuration._get_dispatcher().get_stats()
+
+    @staticmethod
+    def _on_file_event(path: str):
+        """
+        Callback method for FileWatcher, bursts of events for one or more
+        files are collapsed into a single _on_file_change call
+        @param path: file path reporting a change
+        """
+        debounce = Configuration._get_debounce()
+        with Configuration._pending_lock:
+            stats = Configuration._file_event_stats
+            stats["received"] += 1
+            if debounce <= 0:
+                stats["handled"] += 1
+            elif Configuration._pending_timer is not None:
+                # a flush is already scheduled and will handle this path
+                stats["suppressed"] += 1
+                Configuration._pending_changes.add(path)
+                return
+            else:
+                Configuration._pending_changes.add(path)
+                timer = Timer(debounce, Configuration._flush_file_events)
+                timer.daemon = True
+                Configuration._pending_timer = timer
+                timer.start()
+                return
+        Configuration._on_file_change(path)
+
+    @staticmethod
+    def _flush_file_events():
+        """ handle the file change events collected by _on_file_event """
+        with Configuration._pending_lock:
+            paths = sorted(Configuration._pending_changes)
+            Configuration._pending_changes = set()
+            if not paths:
+                Configuration._pending_timer = None
+                return
+            Configuration._file_event_stats["handled"] += 1
+        try:
+            Configuration._on_file_change(*paths)
+        finally:
+            # _pending_timer stays set while reloading, events received in
+            # the meantime are handled by a new flush once this one is done
+            # so reloads never run concurrently
+            with Configuration._pending_lock:
+                if Configuration._pending_changes:
+                    timer = Timer(Configuration._get_debounce(),
+                                  Configuration._flush_file_events)
+                    timer.daemon = True
+                    Configuration._pending_timer = timer
+                    timer.start()
+                else:
+                    Configuration._pending_timer = None
+
+    @staticmethod
+    def get_file_event_stats() -> dict:
+        """
+        Get counters of the file change events seen by the config watcher
+        @return: dict with the number of events "received", the ones
+            "suppressed" because they were merged into an already scheduled
+            reload and the number of reloads "handled"
+        """
+        with Configuration._pending_lock:
+            return dict(Configuration._file_event_stats)
+
+    @staticmethod
+    def _on_file_change(path: str, *other_paths: str):
+        """
+        Reload the config files that changed and notify the callbacks once
         @param path: Configuration file path reporting a change
+        @param other_paths: more file paths that changed at the same time
         """
+        subscribers = list(Configuration._subscribers)
+        # merged config before the reload, to diff against
+        old_merged = Configuration._get_merged() if subscribers else None
+
         # reload updated config
-        for cfg in Configuration.xdg_configs + [Configuration.distribution,
-                                                Configuration.system,
-                                                Configuration.remote]:
-            if cfg.path == path:
-                old_cfg = hash(cfg)
-                try:
-                    cfg.reload()
-                except Exception as e:
-                    # Filewatcher only calls this on file close, so this
-                    # is really an error
-                    LOG.exception(f"Failed to load: {path}: {e}")
-
-                new_cfg = hash(cfg)
-                if old_cfg == new_cfg:
-                    LOG.info(f"{path} unchanged")
-                    return
-                break
-        else:
-            LOG.debug(f"Ignoring non-config file change: {path}")
+        changed = []
+        reloaded = False
+        # every layer except the default config
+        files = Configuration._get_layer_files()[1:]
+        for path in (path,) + other_paths:
+            for cfg_path, cfg in files:
+                if cfg_path == path and cfg is None:
+                    # merged from the shared snapshot, it is checked against
+                    # the config files again on the next read
+                    LOG.info(f'{path} changed on disk')
+                    Configuration._shared_checked = False
+                    changed.append(path)
+                    break
+                if cfg_path == path:
+                    reloaded = True
+                    old_rev = cfg.revision
+                    try:
+                        cfg.reload()
+                    except Exception as e:
+                        # Filewatcher only calls this on file close, so this
+                        # is really an error
+                        LOG.exception(f"Failed to load: {path}: {e}")
+
+                    # reload only modifies the keys whose value changed
+                    if cfg.revision == old_rev:
+                        LOG.info(f"{path} unchanged")
+                    else:
+                        LOG.info(f'{path} changed on disk')
+                        changed.append(path)
+                    break
+            else:
+                LOG.debug(f"Ignoring non-config file change: {path}")
+        if not changed:
             return
 
-        LOG.info(f'{path} changed on disk')
+        if reloaded and Configuration._shared_snapshot_enabled():
+            Configuration._publish_shared_snapshot()
+        dispatcher = Configuration._get_dispatcher()
         LOG.debug(f"Calling {len(Configuration._callbacks)} callbacks")
         for handler in Configuration._callbacks:
-            try:
-                handler()
-            except:
-                LOG.exception("Error in config update callback handler")
+            dispatcher.dispatch(handler, handler)
+
+        if subscribers:
+            changes = diff_configs(old_merged, Configuration._get_merged())
+            LOG.debug(f"{len(changes)} config keys changed")
+            for handler, prefixes in subscribers:
+                selected = filter_changes(changes, prefixes)
+                if selected:
+                    dispatcher.dispatch(handler, handler, selected)
 
     @staticmethod
     def deregister_bus():
@@ -351,8 +1168,22 @@ class Configuration(dict):
                      in the data payload.
         """
         config = message.data.get("config", {})
-        for k, v in config.items():
-            Configuration.__patch[k] = v
+        Configuration._update_patch(config)
+
+    @staticmethod
+    def _update_patch(config: dict):
+        """
+        Update the runtime patch. The patch is copied and the copy swapped
+        in, a merge reading the previous patch in another thread is not
+        affected
+        @param config: keys to set in the patch
+        """
+        with Configuration._patch_lock:
+            # the copy keeps the change history, only the patched keys are
+            # merged again
+            patch = Configuration.__patch.derive()
+            patch.update(config)
+            Configuration.__patch = patch
 
     @staticmethod
     def patch_clear(message):
@@ -362,7 +1193,8 @@ class Configuration(dict):
             message: Messagebus message should contain a config
                      in the data payload.
         """
-        Configuration.__patch = {}
+        with Configuration._patch_lock:
+            Configuration.__patch = LocalConf(None)
 
     # Backwards compat methods
     @staticmethod
@@ -373,7 +1205,7 @@ class Configuration(dict):
 
 def read_mycroft_config():
     """ returns a stateless dict with the loaded configuration """
-    return dict(Configuration())
+    return Configuration.load_all_configs()
 
 
 def update_mycroft_config(config, path=None, bus=None):
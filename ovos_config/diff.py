@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ConfigChange:
+    """
+    A changed key path of the merged configuration. Keys added or removed
+    as a whole, including nested sections, have None as the missing value
+    """
+    path: str
+    old: Any
+    new: Any
+
+
+def diff_configs(old: dict, new: dict, separator: str = "/") -> List[ConfigChange]:
+    """
+    Get the key paths that differ between two merged configs. Subtrees that
+    are the same object in both are skipped without being compared, so
+    diffing configs that share untouched sections is cheap
+    @param old: previous merged config
+    @param new: current merged config
+    @param separator: separator between the keys of a path
+    @return: list of changes, nested dicts are descended into and only the
+        keys that differ inside them are reported
+    """
+    changes = []
+    _diff(old, new, (), separator, changes)
+    return changes
+
+
+def _diff(old: dict, new: dict, path: Tuple[str, ...], separator: str,
+          changes: List[ConfigChange]):
+    if old is new:
+        return
+    for k, o in old.items():
+        p = path + (str(k),)
+        if k not in new:
+            changes.append(ConfigChange(separator.join(p), o, None))
+            continue
+        n = new[k]
+        if o is n:
+            continue
+        if isinstance(o, dict) and isinstance(n, dict):
+            _diff(o, n, p, separator, changes)
+        elif o != n:
+            changes.append(ConfigChange(separator.join(p), o, n))
+    for k, n in new.items():
+        if k not in old:
+            changes.append(ConfigChange(separator.join(path + (str(k),)),
+                                        None, n))
+
+
+def filter_changes(changes: Iterable[ConfigChange],
+                   prefixes: Optional[Iterable[str]] = None,
+                   separator: str = "/") -> List[ConfigChange]:
+    """
+    Select the changes affecting some key path prefixes
+    @param changes: changes as returned by diff_configs
+    @param prefixes: key paths, eg. "listener" or "listener/VAD". None
+        selects every change
+    @param separator: separator between the keys of a path
+    @return: changes inside a prefix, or of a section containing it
+    """
+    if prefixes is None:
+        return list(changes)
+    prefixes = [p.strip(separator) for p in prefixes]
+    return [c for c in changes
+            if any(_overlaps(c.path, p, separator) for p in prefixes)]
+
+
+def _overlaps(path: str, prefix: str, separator: str) -> bool:
+    if not prefix or path == prefix:
+        return True
+    return path.startswith(prefix + separator) or \
+        prefix.startswith(path + separator)
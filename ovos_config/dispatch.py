@@ -0,0 +1,121 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Dict, Hashable, Optional
+
+from ovos_utils.log import LOG
+
+
+class CallbackDispatcher:
+    """
+    Runs callbacks on a bounded thread pool so a slow callback does not delay
+    the others. Calls for the same subscriber run one at a time in the order
+    they were dispatched.
+
+    Threads can not be interrupted, a callback running longer than `timeout`
+    is logged and counted but keeps running. Later calls for that subscriber
+    wait for it, other subscribers are not affected
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: Optional[float] = None):
+        """
+        @param max_workers: size of the thread pool, 0 runs callbacks in the
+            dispatching thread
+        @param timeout: seconds after which a running callback is reported
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        # subscriber -> calls waiting to run, present while a worker drains it
+        self._queues: Dict[Hashable, deque] = {}
+        self._stats: Dict[Hashable, dict] = {}
+
+    def dispatch(self, subscriber: Hashable, func: Callable, *args):
+        """
+        Schedule a callback
+        @param subscriber: calls with the same subscriber run in order
+        @param func: method to call
+        @param args: arguments for `func`
+        """
+        if self.max_workers <= 0:
+            self._run(subscriber, func, args)
+            return
+        with self._lock:
+            queue = self._queues.get(subscriber)
+            if queue is not None:
+                # a worker is already running calls for this subscriber
+                queue.append((func, args))
+                return
+            self._queues[subscriber] = deque([(func, args)])
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="ovos_config_callback")
+            self._executor.submit(self._drain, subscriber)
+
+    def _drain(self, subscriber: Hashable):
+        """ run the queued calls of a subscriber until none are left """
+        while True:
+            with self._lock:
+                queue = self._queues[subscriber]
+                if not queue:
+                    del self._queues[subscriber]
+                    self._idle.notify_all()
+                    return
+                func, args = queue.popleft()
+            self._run(subscriber, func, args)
+
+    def _run(self, subscriber: Hashable, func: Callable, args: tuple):
+        """ call a callback and record its latency """
+        start = monotonic()
+        error = False
+        try:
+            func(*args)
+        except Exception:
+            error = True
+            LOG.exception("Error in config update callback handler")
+        latency = monotonic() - start
+        timed_out = self.timeout is not None and latency > self.timeout
+        if timed_out:
+            LOG.warning(f"Config update callback {func} took {latency:.3f}s, "
+                        f"longer than the {self.timeout}s timeout")
+        with self._lock:
+            stats = self._stats.setdefault(subscriber, {
+                "calls": 0, "errors": 0, "timeouts": 0,
+                "total_latency": 0.0, "max_latency": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["timeouts"] += timed_out
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for every dispatched callback to finish
+        @param timeout: maximum seconds to wait, None waits forever
+        @return: True if no callback is pending
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def get_stats(self) -> Dict[Hashable, dict]:
+        """
+        Get the callback metrics
+        @return: dict of subscriber -> dict with the number of "calls",
+            "errors" and "timeouts" and the "total_latency" and
+            "max_latency" in seconds
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the thread pool, it is created again on the next dispatch
+        @param wait: wait for the pending callbacks to finish
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,81 @@
+from typing import Any, Optional
+
+
+class FrozenDict(dict):
+    """
+    Immutable and hashable dict, safe to share between threads without copying
+    It is still a dict subclass so it can be passed to code expecting one
+    """
+    __slots__ = ("_hash",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hash = None
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict can not be modified")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self.items()))
+        return self._hash
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict.__repr__(self)})"
+
+
+def freeze(value: Any, previous: Optional[dict] = None,
+           memo: Optional[dict] = None) -> Any:
+    """
+    Get an immutable copy of a config value, dicts become FrozenDict and
+    lists become tuples
+    @param value: value to freeze
+    @param previous: `memo` of an earlier call, dicts that were already frozen
+        then are reused instead of frozen again. They must not have been
+        modified in the meantime
+    @param memo: filled with id(dict) -> (dict, frozen) for every dict frozen
+    @return: frozen value
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        entry = previous.get(id(value)) if previous else None
+        reused = entry is not None and entry[0] is value
+        if reused:
+            frozen = entry[1]
+        else:
+            frozen = FrozenDict((k, freeze(v, previous, memo))
+                                for k, v in value.items())
+        if memo is not None:
+            memo[id(value)] = (value, frozen)
+            if reused:
+                # register the nested dicts too so they stay cached
+                _copy_memo(value, previous, memo)
+        return frozen
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v, previous, memo) for v in value)
+    if isinstance(value, set):
+        return frozenset(freeze(v, previous, memo) for v in value)
+    return value
+
+
+def _copy_memo(value: dict, previous: dict, memo: dict):
+    """ carry over the memo entries of the dicts nested in a reused dict """
+    for v in value.values():
+        if isinstance(v, dict):
+            entry = previous.get(id(v))
+            if entry is not None and entry[0] is v:
+                memo[id(v)] = entry
+                _copy_memo(v, previous, memo)
@@ -0,0 +1,120 @@
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class KeyPathIndex:
+    """
+    Flat index of every key path of a nested config dict, for searching keys
+    without walking the whole tree. Matching is case insensitive.
+
+    Entries are kept in depth first order, the same order a recursive walk
+    of the dict yields them in
+    """
+
+    def __init__(self, config: dict, separator: str = "/"):
+        self.separator = separator
+        self._paths: List[Tuple[str, ...]] = []
+        self._lower: List[Tuple[str, ...]] = []
+        self._values: List[Any] = []
+        # lowercase key -> indexes of the entries whose path ends with it
+        self._by_key: Dict[str, List[int]] = {}
+        # lowercase joined path -> index of the first entry with that path
+        self._by_path: Dict[str, int] = {}
+        self._build(config)
+        # sorted (lowercase joined path, index) pairs for prefix lookups
+        self._sorted = sorted((separator.join(lower), idx)
+                              for idx, lower in enumerate(self._lower))
+        for joined, idx in reversed(self._sorted):
+            self._by_path[joined] = idx
+
+    def _build(self, config: dict):
+        """ index `config` depth first, iteratively to bound stack usage """
+        stack = [((), iter(config.items()))]
+        while stack:
+            parent, items = stack[-1]
+            for k, v in items:
+                k = str(k)
+                path = parent + (k,)
+                lower = k.lower()
+                self._by_key.setdefault(lower, []).append(len(self._paths))
+                self._paths.append(path)
+                self._lower.append(tuple(p.lower() for p in path))
+                self._values.append(v)
+                if isinstance(v, dict):
+                    stack.append((path, iter(v.items())))
+                    break
+            else:
+                stack.pop()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def _entry(self, idx: int) -> Tuple[str, Any]:
+        return self.separator.join(self._paths[idx]), self._values[idx]
+
+    def get(self, path: str, default: Any = None) -> Any:
+        """
+        Get the value at an exact key path
+        @param path: keys separated by the index separator, a leading
+            separator is ignored
+        @param default: value returned if the path is not indexed
+        @return: config value
+        """
+        idx = self._by_path.get(path.lstrip(self.separator).lower())
+        return default if idx is None else self._values[idx]
+
+    def prefix(self, prefix: str,
+               only_endpoints: bool = False) -> Iterator[Tuple[str, Any]]:
+        """
+        Find the key paths starting with a path prefix
+        @param prefix: start of the joined key path, eg. "tts/mod"
+        @param only_endpoints: if True skip paths whose value is a dict
+        @return: iterator of (path, value) tuples in depth first order
+        """
+        prefix = prefix.lstrip(self.separator).lower()
+        matches = []
+        for joined, idx in self._sorted[bisect_left(self._sorted, (prefix,)):]:
+            if not joined.startswith(prefix):
+                break
+            matches.append(idx)
+        return self._iter(sorted(matches), only_endpoints)
+
+    def search(self, key: str,
+               only_endpoints: bool = False) -> Iterator[Tuple[str, Any]]:
+        """
+        Find the key paths matching a loose or absolute query.
+        Every component of the query must be a substring of the matching
+        component at the end of the path, eg. "tts/mod" matches
+        "tts/module" and "listener/tts/module_x". A query starting with the
+        separator is absolute and only matches paths of the same length
+        @param key: query, components separated by the index separator
+        @param only_endpoints: if True skip paths whose value is a dict
+        @return: iterator of (path, value) tuples in depth first order
+        """
+        absolute = key.startswith(self.separator)
+        parts = (key[1:] if absolute else key).lower().split(self.separator)
+        last = parts[-1]
+        candidates = []
+        for name, indexes in self._by_key.items():
+            if last in name:
+                candidates.extend(indexes)
+        matches = [idx for idx in candidates
+                   if self._matches(self._lower[idx], parts, absolute)]
+        return self._iter(sorted(matches), only_endpoints)
+
+    @staticmethod
+    def _matches(path: Tuple[str, ...], parts: List[str],
+                 absolute: bool) -> bool:
+        if absolute and len(path) != len(parts):
+            return False
+        if len(path) < len(parts):
+            return False
+        return all(part in p for part, p in zip(parts, path[-len(parts):]))
+
+    def _iter(self, indexes: List[int],
+              only_endpoints: bool) -> Iterator[Tuple[str, Any]]:
+        for idx in indexes:
+            if only_endpoints and isinstance(self._values[idx], dict):
+                continue
+            yield self._entry(idx)
+
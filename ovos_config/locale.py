@@ -83,7 +83,7 @@ def set_default_lang(lang):
             pass
 
 def get_config_tz():
-    code = ovos_config.Configuration()["location"]["timezone"]["code"]
+    code = ovos_config.Configuration.get_path("location/timezone/code")
     return gettz(code)
 
 
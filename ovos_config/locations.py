@@ -12,10 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-from os.path import join, dirname, expanduser, exists, isfile
-from time import sleep
+from os.path import join, dirname, expanduser, isfile
 import ovos_config.meta as _ovos_config
-from ovos_utils.xdg_utils import xdg_config_dirs, xdg_config_home, xdg_data_dirs, xdg_data_home, xdg_cache_home
+from ovos_utils.xdg_utils import xdg_config_dirs, xdg_config_home, xdg_data_dirs, xdg_data_home, xdg_cache_home, \
+    xdg_runtime_dir
 
 
 def get_xdg_config_dirs(folder=None):
@@ -49,6 +49,13 @@ def get_xdg_cache_save_path(folder=None):
     return join(xdg_cache_home(), folder)
 
 
+def get_xdg_runtime_save_path(folder=None):
+    """ return base XDG runtime save path taking into account ovos.conf
+    falls back to the XDG cache save path if XDG_RUNTIME_DIR is not set """
+    folder = folder or _ovos_config.get_xdg_base()
+    return join(xdg_runtime_dir() or xdg_cache_home(), folder)
+
+
 def find_user_config():
     """ return user config full file path taking into account ovos.conf """
     path = join(get_xdg_config_save_path(), _ovos_config.get_config_filename())
@@ -123,25 +130,3 @@ REMOTE_CONFIG = "mycroft.ai"
 WEB_CONFIG_CACHE = os.environ.get('MYCROFT_WEB_CACHE') or \
                    get_webcache_location()
 
-
-def __ensure_folder_exists(path):
-    """ Make sure the directory for the specified path exists.
-
-        Args:
-            path (str): path to config file
-     """
-    directory = dirname(path)
-    if not exists(directory):
-        try:
-            os.makedirs(directory)
-        except:
-            sleep(0.2)
-            if not exists(directory):
-                try:
-                    os.makedirs(directory)
-                except Exception as e:
-                    pass
-
-
-__ensure_folder_exists(WEB_CONFIG_CACHE)
-__ensure_folder_exists(USER_CONFIG)
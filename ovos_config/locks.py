@@ -0,0 +1,121 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from os.path import abspath, basename, join
+from threading import Lock
+from typing import Dict, Iterator
+
+from ovos_utils.log import LOG
+
+# lock files are shared by every user, like combo_lock's
+_LOCK_FILE_ACCESS_RIGHTS = 0o666
+
+
+class ConfigFileLock:
+    """
+    Reader/writer lock for a single config file, across threads and processes.
+
+    Each acquisition opens the lock file and takes a flock on it, shared for
+    reading and exclusive for writing. Separate opens do not share their
+    locks, so threads of the same process exclude each other like separate
+    processes do. The lock is not reentrant and can not be upgraded: a thread
+    holding it, shared or exclusive, deadlocks if it acquires it again.
+    Where flock is not available (windows) both modes fall back to an
+    exclusive combo_lock
+    """
+
+    def __init__(self, path: str):
+        """
+        @param path: config file the lock protects
+        """
+        self.path = abspath(path)
+        self.lock_path = join(_get_lock_directory(), _lock_file_name(self.path))
+        self._fallback = None
+        self._permissions_set = False
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """ hold the lock shared, other readers may hold it too """
+        with self._locked(exclusive=False):
+            yield
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """ hold the lock exclusively """
+        with self._locked(exclusive=True):
+            yield
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        try:
+            import fcntl
+        except ImportError:
+            with self._get_fallback():
+                yield
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT,
+                     _LOCK_FILE_ACCESS_RIGHTS)
+        try:
+            if not self._permissions_set:
+                # not allowed if another user created it, it is then already set
+                try:
+                    os.fchmod(fd, _LOCK_FILE_ACCESS_RIGHTS)
+                except OSError:
+                    pass
+                self._permissions_set = True
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+
+    def _get_fallback(self):
+        if self._fallback is None:
+            from combo_lock import ComboLock
+            self._fallback = ComboLock(self.lock_path)
+        return self._fallback
+
+
+def _lock_file_name(path: str) -> str:
+    """ return a filesystem safe lock file name for a config file path """
+    digest = hashlib.blake2b(path.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{basename(path)[:64]}.{digest}.lock"
+
+
+_lock_directory = None
+
+
+def _get_lock_directory() -> str:
+    """ return the directory holding the lock files, creating it if needed """
+    global _lock_directory
+    if _lock_directory is None:
+        try:
+            from combo_lock.util import get_ram_directory
+            _lock_directory = get_ram_directory("ovos_config_locks")
+        except Exception as e:
+            from tempfile import gettempdir
+            LOG.warning(f"Failed to get ram directory for config locks: {e}")
+            _lock_directory = join(gettempdir(), "ovos_config_locks")
+            os.makedirs(_lock_directory, exist_ok=True)
+    return _lock_directory
+
+
+_file_locks: Dict[str, ConfigFileLock] = {}
+_file_locks_init = Lock()
+
+
+def get_file_lock(path: str) -> ConfigFileLock:
+    """
+    Get the lock of a config file, the same object is returned for every
+    spelling of the same path
+    @param path: config file path
+    @return: reader/writer lock for the file
+    """
+    path = abspath(path)
+    lock = _file_locks.get(path)
+    if lock is None:
+        with _file_locks_init:
+            lock = _file_locks.get(path)
+            if lock is None:
+                lock = _file_locks[path] = ConfigFileLock(path)
+    return lock
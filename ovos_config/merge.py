@@ -0,0 +1,180 @@
+from functools import lru_cache
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+# marks a protected key in a trie built by compile_key_paths
+PROTECTED = True
+
+
+@lru_cache(maxsize=32)
+def compile_key_paths(paths: Tuple[str, ...], separator: str = ":") -> dict:
+    """
+    Compile protected key paths into a trie usable by merge_layer
+    @param paths: key paths, eg. ("location", "skills:blacklisted_skills")
+    @param separator: separator between the keys of a path
+    @return: nested dict of keys, leaves are PROTECTED. Must not be modified
+    """
+    trie = {}
+    for path in paths:
+        keys = path.split(separator)
+        node = trie
+        for k in keys[:-1]:
+            node = node.setdefault(k, {})
+            if node is PROTECTED:
+                # a parent key is already protected
+                break
+        else:
+            node[keys[-1]] = PROTECTED
+    return trie
+
+
+def merge_layer(base: dict, delta: dict,
+                protected: Optional[dict] = None, share: bool = False) -> dict:
+    """
+    Merge `delta` on top of `base` without modifying either of them.
+    Only the nested dicts changed by `delta` are copied, untouched
+    subtrees are shared with `base`
+    @param base: merged dict of the layers below
+    @param delta: config layer to merge on top
+    @param protected: trie from compile_key_paths, keys of `delta` it
+        protects are skipped
+    @param share: if True the nested dicts of `delta` that do not need to be
+        merged with `base` are referenced instead of copied, `delta` must
+        then never be modified in place
+    @return: new merged dict
+    """
+    merged = dict(base)
+    for k, d in delta.items():
+        node = protected.get(k) if protected else None
+        if node is PROTECTED:
+            continue
+        if isinstance(d, dict):
+            b = merged.get(k)
+            if share and node is None and not isinstance(b, dict):
+                merged[k] = d
+            else:
+                merged[k] = merge_layer(b if isinstance(b, dict) else {},
+                                        d, node, share)
+        else:
+            merged[k] = d
+    return merged
+
+
+class LayeredMerge:
+    """
+    Incrementally merged stack of config layers.
+
+    The merged result of every prefix of the stack is kept, when a layer
+    changes only that layer and the ones above it are merged again
+    """
+
+    def __init__(self):
+        self._states: List[Hashable] = []
+        self._prefixes: List[dict] = []
+
+    @property
+    def merged(self) -> dict:
+        """merged dict of the whole stack, must not be modified"""
+        return self._prefixes[-1] if self._prefixes else {}
+
+    def get_prefix(self, idx: int) -> dict:
+        """
+        Get the merged result of the stack up to a layer
+        @param idx: index of the last layer to include
+        @return: merged dict, must not be modified
+        """
+        return self._prefixes[idx]
+
+    def update(self, states: Sequence[Hashable],
+               get_layer: Callable[[int], Optional[dict]],
+               get_changed_keys: Optional[Callable[[int, Hashable],
+                                                   Optional[set]]] = None,
+               get_protected: Optional[Callable[[int], Optional[dict]]] = None,
+               get_shared: Optional[Callable[[int], bool]] = None
+               ) -> dict:
+        """
+        Merge the stack again starting from the first layer that changed
+        @param states: one hashable token per layer, a layer whose token
+            differs from the previous call is considered changed
+        @param get_layer: method returning the dict to merge for a layer
+            index, or None if the layer should be skipped
+        @param get_changed_keys: optional method returning the top level keys
+            modified in a layer since its previous state, or None if unknown.
+            When every changed layer reports its keys, only those subtrees
+            are merged again
+        @param get_protected: optional method returning the trie of keys
+            from compile_key_paths that can not be set by a layer index
+        @param get_shared: optional method returning True if the nested dicts
+            of a layer index are never modified in place, they are then
+            shared with the merged result instead of copied
+        @return: merged dict of the whole stack, must not be modified
+        """
+        first = 0
+        for old, new in zip(self._states, states):
+            if old != new:
+                break
+            first += 1
+        if first == len(states) == len(self._states):
+            return self.merged
+
+        dirty = None
+        if get_changed_keys and len(states) == len(self._states):
+            dirty = set()
+            for idx in range(first, len(states)):
+                if states[idx] == self._states[idx]:
+                    continue
+                keys = get_changed_keys(idx, self._states[idx])
+                if keys is None:
+                    dirty = None
+                    break
+                dirty.update(keys)
+
+        prefixes = self._prefixes[:first]
+        base = prefixes[-1] if prefixes else {}
+        for idx in range(first, len(states)):
+            layer = get_layer(idx)
+            protected = get_protected(idx) if get_protected and layer else None
+            share = bool(get_shared(idx)) if get_shared and layer else False
+            if dirty is None:
+                if layer:
+                    base = merge_layer(base, layer, protected, share)
+            else:
+                base = self._merge_keys(self._prefixes[idx], base,
+                                        layer or {}, dirty, protected, share)
+            prefixes.append(base)
+        self._states = list(states)
+        self._prefixes = prefixes
+        return base
+
+    @staticmethod
+    def _merge_keys(old: dict, base: dict, layer: dict, keys: set,
+                    protected: Optional[dict] = None,
+                    share: bool = False) -> dict:
+        """
+        Update a previously merged prefix, merging only the given keys again
+        @param old: previous merged dict for this layer
+        @param base: merged dict of the layers below
+        @param layer: config layer to merge on top
+        @param keys: top level keys to merge again
+        @param protected: trie of keys the layer can not set
+        @param share: reference the nested dicts of `layer` if possible
+        @return: new merged dict
+        """
+        merged = dict(old)
+        for k in keys:
+            node = protected.get(k) if protected else None
+            if k in layer and node is not PROTECTED:
+                d = layer[k]
+                if isinstance(d, dict):
+                    b = base.get(k)
+                    if share and node is None and not isinstance(b, dict):
+                        merged[k] = d
+                    else:
+                        merged[k] = merge_layer(
+                            b if isinstance(b, dict) else {}, d, node, share)
+                else:
+                    merged[k] = d
+            elif k in base:
+                merged[k] = base[k]
+            else:
+                merged.pop(k, None)
+        return merged
@@ -12,36 +12,318 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import atexit
+import copy
+import copyreg
+import hashlib
+import itertools
 import json
-import yaml
+import marshal
+import os
 
+from threading import Lock, Timer
 from time import time
-from os.path import exists, isfile, getmtime
-from combo_lock import NamedLock
+from typing import Optional
+from os.path import exists, isfile, getmtime, join, dirname, abspath, realpath
 from ovos_utils.json_helper import load_commented_json, merge_dict
 from ovos_utils.log import LOG
 
-from ovos_config.locations import USER_CONFIG, DISTRIBUTION_CONFIG, SYSTEM_CONFIG, WEB_CONFIG_CACHE, DEFAULT_CONFIG
+from ovos_config.locks import get_file_lock
+from ovos_config.locations import USER_CONFIG, DISTRIBUTION_CONFIG, SYSTEM_CONFIG, WEB_CONFIG_CACHE, DEFAULT_CONFIG, \
+    get_xdg_cache_save_path
+
+
+def _parse_cache_enabled() -> bool:
+    """ parsed config files are only cached on disk if OVOS_CONFIG_PARSE_CACHE is set """
+    return os.environ.get("OVOS_CONFIG_PARSE_CACHE", "").lower() in ("1", "true", "yes")
+
+
+def _get_parse_cache_path(path: str) -> str:
+    """ return the parse cache file for a config file path """
+    name = hashlib.blake2b(abspath(path).encode("utf-8"), digest_size=16).hexdigest()
+    return join(get_xdg_cache_save_path(), "config_cache", f"{name}.marshal")
+
+
+def _read_parse_cache(path: str, key: tuple) -> Optional[dict]:
+    """
+    Read a previously parsed config file from the on-disk cache
+    @param path: config file path
+    @param key: file signature and content digest the entry must match
+    @return: parsed config, None if not cached or outdated
+    """
+    try:
+        with open(_get_parse_cache_path(path), "rb") as f:
+            cached_key, config = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if cached_key != key:
+        return None
+    return config
+
+
+def _write_parse_cache(path: str, key: tuple, config: dict):
+    """
+    Store a parsed config file in the on-disk cache
+    @param path: config file path
+    @param key: file signature and content digest of the parsed contents
+    @param config: parsed config
+    """
+    cache_path = _get_parse_cache_path(path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        data = marshal.dumps((key, config))
+        os.makedirs(dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError) as e:
+        # eg. yaml types marshal can not handle, read only cache dir
+        LOG.debug(f"Failed to cache parsed config '{path}': {e}")
+
+
+# path -> (data, timer) of delayed stores not written yet, see LocalConf.store
+_pending_stores = {}
+_pending_lock = Lock()
+_flush_registered = False
+
+
+def _get_store_delay() -> float:
+    """ stores are coalesced for OVOS_CONFIG_STORE_DELAY seconds if set """
+    try:
+        return float(os.environ.get("OVOS_CONFIG_STORE_DELAY") or 0)
+    except ValueError:
+        return 0
+
+
+def _write_config_file(path: str, config: dict):
+    """
+    Atomically replace a config file, readers see either the old or the new
+    contents but never a partially written file
+    @param path: config file path
+    @param config: contents to write, in the format given by the file extension
+    """
+    # replace the target of a symlinked config, not the link itself
+    path = realpath(path)
+    folder = dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = join(folder, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            if path.endswith(".yml") or path.endswith(".yaml"):
+                import yaml
+                yaml.dump(dict(config), f, allow_unicode=True,
+                          default_flow_style=False, sort_keys=False)
+            else:
+                json.dump(config, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # eg. directories can not be opened on windows
+    # FileWatcher only reports files modified and closed under their own
+    # name, which a rename is not. touch the file so watchers in every
+    # process still see the change
+    try:
+        os.utime(path)
+        with open(path, 'a'):
+            pass
+    except OSError:
+        pass
+
+
+def _flush_store(path: str):
+    """ write a delayed store now, if it is still pending """
+    with _pending_lock:
+        entry = _pending_stores.pop(path, None)
+    if entry is None:
+        return
+    config, timer = entry
+    timer.cancel()
+    with LocalConf._get_lock(), get_file_lock(path).write():
+        _write_config_file(path, config)
+
+
+def flush_pending_stores():
+    """ write every delayed store now, see LocalConf.store """
+    for path in list(_pending_stores):
+        try:
+            _flush_store(path)
+        except Exception:
+            LOG.exception(f"Failed to store configuration '{path}'")
+
+
+# source of LocalConf.changes, next() on it is atomic
+_change_counter = itertools.count(1)
 
 
 class LocalConf(dict):
     """Config dictionary from file."""
     allow_overwrite = True
-    # lock is shared among all subclasses,
+    # changes whenever any LocalConf is modified, lets Configuration tell
+    # with one comparison that none of its layers changed
+    changes = 0
+    # write lock is shared among all subclasses,
     # regardless of what file is being edited only one file should change at a time
     # this ensures orderly behaviour in anything monitoring changes,
     #   eg FileWatcher util, configuration.patch bus handlers
-    __lock = NamedLock("ovos_config")
+    # stores then take the lock of the file they write, see ovos_config.locks,
+    # loads only take the file lock shared and do not wait for other files
+    # created on first use, combo_lock is slow to import
+    __lock = None
+    __lock_init = Lock()
 
     def __init__(self, path):
         super().__init__(self)
         self.path = path
         self._last_loaded = None
+        # stat signature and content digest of the file at last load
+        self._last_signature = None
+        self._last_digest = None
+        # shared with the copies made by derive(), whose revisions continue
+        # the ones of this config
+        self._lineage = object()
+        # bumped on every mutation, lets Configuration detect stale merges
+        self._revision = 0
+        # revision at which each top level key was last modified
+        self._changed_at = {}
+        # content digest. the digest of the file contents covers the keys as
+        # loaded, keys set in memory afterwards are hashed one by one, lazily
+        self._digest_base = None
+        self._digest = 0
+        self._key_digests = {}
+        self._stale_digests = set()
         if path:
             self.load_local(path)
 
+    @staticmethod
+    def _get_lock():
+        """ return the write lock shared by all config files, creating it if needed """
+        if LocalConf.__lock is None:
+            with LocalConf.__lock_init:
+                if LocalConf.__lock is None:
+                    from combo_lock import NamedLock
+                    LocalConf.__lock = NamedLock("ovos_config")
+        return LocalConf.__lock
+
     def __hash__(self):
-        return hash(json.dumps(dict(self), sort_keys=True))
+        # only the keys modified since the last call are serialized again
+        for k in self._stale_digests:
+            self._digest -= self._key_digests.pop(k, 0)
+            if dict.__contains__(self, k):
+                digest = hash((k, json.dumps(dict.__getitem__(self, k),
+                                             sort_keys=True, default=str)))
+                self._key_digests[k] = digest
+                self._digest += digest
+        self._stale_digests.clear()
+        return hash((self._digest_base, self._digest))
+
+    @property
+    def revision(self) -> int:
+        """monotonic counter incremented every time this config is modified"""
+        return self._revision
+
+    @property
+    def lineage(self) -> object:
+        """token shared by this config and the copies made by derive()"""
+        return self._lineage
+
+    def derive(self) -> "LocalConf":
+        """
+        Get an in memory copy that continues the revision history of this
+        config, changed_keys() of the copy covers the revisions of both.
+        Nested values are shared, not copied
+        @return: copy with the same lineage
+        """
+        conf = LocalConf(None)
+        dict.update(conf, self)
+        conf._lineage = self._lineage
+        conf._revision = self._revision
+        conf._changed_at = dict(self._changed_at)
+        conf._digest_base = self._digest_base
+        conf._digest = self._digest
+        conf._key_digests = dict(self._key_digests)
+        conf._stale_digests = set(self._stale_digests)
+        return conf
+
+    def changed_keys(self, revision: int) -> set:
+        """
+        Get the top level keys modified after a given revision
+        @param revision: previously seen value of `self.revision`
+        @return: set of keys that were set or deleted since `revision`
+        """
+        return {k for k, rev in self._changed_at.items() if rev > revision}
+
+    def _touch(self, keys):
+        self._revision += 1
+        for k in keys:
+            self._changed_at[k] = self._revision
+            self._stale_digests.add(k)
+        LocalConf.changes = next(_change_counter)
+
+    def __reduce__(self):
+        # restore the attributes before the items, which are set through
+        # __setitem__ by the default dict pickling
+        return copyreg.__newobj__, (type(self),), (self.__dict__, dict(self))
+
+    def __setstate__(self, state):
+        attrs, items = state
+        self.__dict__.update(attrs)
+        dict.update(self, items)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._touch([key])
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._touch([key])
+
+    def update(self, *args, **kwargs):
+        delta = dict(*args, **kwargs)
+        super().update(delta)
+        self._touch(delta)
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self._touch([key])
+        return value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return super().__getitem__(key)
+        value = super().setdefault(key, default)
+        self._touch([key])
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._touch([key])
+        return key, value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        keys = list(self)
+        super().clear()
+        self._touch(keys)
 
     def _get_file_format(self, path=None):
         """The config file format
@@ -60,6 +342,32 @@ class LocalConf(dict):
         else:
             return "json"
 
+    @staticmethod
+    def _get_file_signature(path: str) -> Optional[tuple]:
+        """
+        Get a cheap signature of a file that changes when it is rewritten
+        @param path: file path
+        @return: (size, mtime, inode) tuple, None if the file can not be read
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    @staticmethod
+    def _get_file_digest(path: str) -> Optional[bytes]:
+        """
+        Get a digest of the raw file contents
+        @param path: file path
+        @return: digest bytes, None if the file can not be read
+        """
+        try:
+            with open(path, "rb") as f:
+                return hashlib.blake2b(f.read(), digest_size=16).digest()
+        except OSError:
+            return None
+
     def load_local(self, path=None):
         """
         Load local json file into self.
@@ -71,52 +379,135 @@ class LocalConf(dict):
         if not path:
             LOG.error("in memory configuration, nothing to load")
             return
-        if exists(path) and isfile(path):
-            with self.__lock:
+        pending = _pending_stores.get(abspath(path))
+        if pending is not None or (exists(path) and isfile(path)):
+            with get_file_lock(path).read():
+                # read before parsing, if the file changes in between the
+                # next reload sees a different digest and parses it again
+                signature = self._get_file_signature(path)
+                digest = self._get_file_digest(path)
+                cache_key = None
+                if _parse_cache_enabled() and signature and digest:
+                    cache_key = (abspath(path), signature, digest, marshal.version)
                 try:
-                    if self._get_file_format(path) == "yaml":
-                        with open(path, encoding="utf-8") as f:
-                            config = yaml.safe_load(f)
-                    else:
-                        config = load_commented_json(path)
+                    config = None
+                    if pending is not None:
+                        # the file is outdated until the delayed store runs
+                        config = copy.deepcopy(pending[0])
+                        LOG.debug(f"Loaded {path} from pending store")
+                    elif cache_key:
+                        config = _read_parse_cache(path, cache_key)
+                        if config is not None:
+                            LOG.debug(f"Loaded parsed {path} from cache")
+                    if config is None:
+                        if self._get_file_format(path) == "yaml":
+                            import yaml
+                            with open(path, encoding="utf-8") as f:
+                                config = yaml.safe_load(f)
+                        else:
+                            config = load_commented_json(path)
+                        if cache_key and isinstance(config, dict):
+                            _write_parse_cache(path, cache_key, config)
                     if config:
                         for key in config:
-                            self.__setitem__(key, config[key])
+                            # unchanged keys keep their revision, a reload
+                            # only bumps it if some value changed
+                            if not dict.__contains__(self, key) or \
+                                    dict.__getitem__(self, key) != config[key]:
+                                self.__setitem__(key, config[key])
                         LOG.debug(f"Configuration {path} loaded")
                     else:
                         LOG.debug(f"Empty config found at: {path}")
+                    if pending is None and digest is not None and \
+                            path == self.path:
+                        # the file digest stands for the loaded keys, they
+                        # are not serialized again by __hash__
+                        self._digest_base = digest
+                        self._digest = 0
+                        self._key_digests = {}
+                        self._stale_digests = set(self) - set(config or ())
                 except Exception as e:
                     LOG.exception(f"Error loading configuration '{path}'")
                 if path == self.path and isfile(self.path):
                     self._last_loaded = getmtime(self.path)
+                    self._last_signature = signature
+                    self._last_digest = digest
         else:
             LOG.debug(f"Configuration '{path}' not defined, skipping")
 
     def reload(self):
-        if isfile(self.path) \
-            and self._last_loaded \
-            and self._last_loaded == getmtime(self.path):
-            LOG.debug(f"{self.path} not changed since last load "
-                      f"(changed {time() - self._last_loaded} seconds ago)")
-            return
+        if isfile(self.path) and self._last_loaded:
+            signature = self._get_file_signature(self.path)
+            if signature == self._last_signature:
+                LOG.debug(f"{self.path} not changed since last load "
+                          f"(changed {time() - self._last_loaded} seconds ago)")
+                return
+            # file was rewritten, only parse it if the contents changed
+            digest = self._get_file_digest(self.path)
+            if digest is not None and digest == self._last_digest:
+                LOG.debug(f"{self.path} rewritten with identical contents")
+                self._last_loaded = getmtime(self.path)
+                self._last_signature = signature
+                return
         self.load_local(self.path)
 
-    def store(self, path=None):
+    def store(self, path=None, delay: Optional[float] = None):
+        """
+        Write the configuration to file. The file is replaced atomically
+        @param path: file to write, defaults to the loaded file
+        @param delay: if set, wait this many seconds before writing. Stores
+            of the same path within the delay are coalesced into a single
+            write of the latest contents. Defaults to OVOS_CONFIG_STORE_DELAY
+        """
         path = path or self.path
         if not path:
             LOG.error("in memory configuration, no save location")
             return
-        with self.__lock:
-            if self._get_file_format(path) == "yaml":
-                with open(path, 'w+', encoding="utf-8") as f:
-                    yaml.dump(dict(self), f, allow_unicode=True,
-                              default_flow_style=False, sort_keys=False)
-            else:
-                with open(path, 'w+', encoding="utf-8") as f:
-                    json.dump(self, f, indent=2)
+        path = abspath(path)
+        if delay is None:
+            delay = _get_store_delay()
+        if delay > 0:
+            self._store_delayed(path, delay)
+            return
+        with _pending_lock:
+            # superseded by this store
+            entry = _pending_stores.pop(path, None)
+        if entry is not None:
+            entry[1].cancel()
+        with self._get_lock(), get_file_lock(path).write():
+            _write_config_file(path, self)
+
+    async def astore(self, path=None, delay: Optional[float] = None):
+        """
+        Write the configuration to file without blocking the event loop,
+        the file is written in the loop's default executor. See store()
+        @param path: file to write, defaults to the loaded file
+        @param delay: if set, wait this many seconds before writing
+        """
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.store, path, delay)
+
+    def _store_delayed(self, path: str, delay: float):
+        """ schedule a store, replacing any pending store of the same path """
+        global _flush_registered
+        config = copy.deepcopy(dict(self))
+        timer = Timer(delay, _flush_store, (path,))
+        timer.daemon = True
+        with _pending_lock:
+            entry = _pending_stores.get(path)
+            if entry is not None:
+                entry[1].cancel()
+            _pending_stores[path] = (config, timer)
+            if not _flush_registered:
+                atexit.register(flush_pending_stores)
+                _flush_registered = True
+        timer.start()
 
     def merge(self, conf):
         merge_dict(self, conf)
+        # nested dicts are merged in place, bypassing __setitem__
+        self._touch(conf)
 
 
 class ReadOnlyConfig(LocalConf):
@@ -142,10 +533,10 @@ class ReadOnlyConfig(LocalConf):
             raise PermissionError(f"{self.path} is read only! it can not be modified at runtime")
         super().merge(*args, **kwargs)
 
-    def store(self, path=None):
+    def store(self, path=None, delay=None):
         if not self.allow_overwrite:
             raise PermissionError(f"{self.path} is read only! it can not be modified at runtime")
-        super().store(path)
+        super().store(path, delay)
 
 
 class MycroftDefaultConfig(ReadOnlyConfig):
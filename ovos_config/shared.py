@@ -0,0 +1,142 @@
+import marshal
+import mmap
+import os
+import struct
+from os.path import dirname
+from threading import Lock
+from time import sleep
+from typing import Optional, Tuple
+
+from ovos_utils.log import LOG
+
+# magic, sequence number, payload length, key digest
+_HEADER = struct.Struct("<8sQQ16s")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+_MAGIC = b"OVOSCFG1"
+
+
+def shared_snapshot_enabled() -> bool:
+    """ merged config is only shared between processes if OVOS_CONFIG_SHARED_SNAPSHOT is set """
+    return os.environ.get("OVOS_CONFIG_SHARED_SNAPSHOT", "").lower() in ("1", "true", "yes")
+
+
+class SharedSnapshot:
+    """
+    Merged configuration shared between processes through a memory mapped file.
+
+    The file starts with a header holding a sequence number that is odd while
+    a write is in progress. Writers serialize on a file lock and update the
+    file in place, readers never lock: they map the file read only, check the
+    sequence number before and after copying the payload and only unmarshal
+    it again when the sequence number changed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self._map_lock = Lock()
+        # (sequence number, key, data) of the last successful read
+        self._cached = (None, None, None)
+
+    def _map(self, min_size: int = 0) -> Optional[mmap.mmap]:
+        """
+        Map the snapshot file, remapping it if it grew past the mapped size
+        @param min_size: minimum size the mapping must cover
+        @return: read only mapping, None if the file does not exist yet
+        """
+        mm = self._mm
+        if mm is not None and len(mm) >= max(min_size, _HEADER.size):
+            return mm
+        with self._map_lock:
+            try:
+                f = open(self.path, "rb")
+                size = os.fstat(f.fileno()).st_size
+                if size < max(min_size, _HEADER.size):
+                    f.close()
+                    return None
+                new = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+            # old mappings are left to the garbage collector, another
+            # thread may still be reading from them
+            self._file, self._mm = f, new
+            return new
+
+    @property
+    def version(self) -> int:
+        """ sequence number of the snapshot, 0 if there is none """
+        mm = self._map()
+        if mm is None:
+            return 0
+        return _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+
+    def read(self, retries: int = 10) -> Optional[Tuple[bytes, dict]]:
+        """
+        Read the snapshot, reusing the previous result if it did not change
+        @param retries: attempts to get a consistent read while a write is
+            in progress
+        @return: (key, data) tuple, None if no consistent snapshot is available
+        """
+        for _ in range(retries):
+            mm = self._map()
+            if mm is None:
+                return None
+            magic, seq, length, key = _HEADER.unpack_from(mm)
+            if magic != _MAGIC:
+                return None
+            cached_seq, cached_key, cached_data = self._cached
+            if seq == cached_seq:
+                return cached_key, cached_data
+            if seq % 2:
+                # write in progress
+                sleep(0.001)
+                continue
+            mm = self._map(_HEADER.size + length)
+            if mm is None:
+                return None
+            payload = mm[_HEADER.size:_HEADER.size + length]
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] != seq:
+                # modified while copying
+                continue
+            try:
+                data = marshal.loads(payload)
+            except (EOFError, ValueError, TypeError):
+                continue
+            self._cached = (seq, key, data)
+            return key, data
+        return None
+
+    def write(self, key: bytes, data: dict) -> int:
+        """
+        Publish a new snapshot
+        @param key: 16 bytes digest identifying the sources of `data`
+        @param data: marshallable snapshot contents
+        @return: new sequence number
+        """
+        import fcntl
+        payload = marshal.dumps(data)
+        size = _HEADER.size + len(payload)
+        os.makedirs(dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # never shrink the file, readers may have it mapped
+            size = max(size, os.fstat(fd).st_size)
+            os.ftruncate(fd, size)
+            with mmap.mmap(fd, size) as mm:
+                magic, seq, _, _ = _HEADER.unpack_from(mm)
+                if magic != _MAGIC:
+                    seq = 0
+                # odd while writing, skip an odd value left by a crashed writer
+                seq += 1 + seq % 2
+                _HEADER.pack_into(mm, 0, _MAGIC, seq, 0, b"")
+                mm[_HEADER.size:_HEADER.size + len(payload)] = payload
+                seq += 1
+                _HEADER.pack_into(mm, 0, _MAGIC, seq, len(payload), key)
+                mm.flush()
+        finally:
+            os.close(fd)
+        LOG.debug(f"Published merged configuration snapshot {seq} to {self.path}")
+        return seq
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from os.path import dirname, join
+from unittest import TestCase
+
+# generous upper bound for a CLI invocation in a fresh interpreter, meant to
+# catch the config being loaded at import again rather than to benchmark
+CLI_TIME_BUDGET = 3.0
+
+_IMPORT_CLI = """
+import json, sys
+import ovos_config.__main__
+from ovos_config.config import Configuration
+print(json.dumps({"loaded": [n for n in ("default", "system", "remote",
+                                         "xdg_configs")
+                             if Configuration._get_loaded_layer(n) is not None],
+                  "combo_lock": "combo_lock" in sys.modules}))
+"""
+
+
+class TestCLI(TestCase):
+    test_dir = join(dirname(__file__), "test_config", "cli")
+
+    def setUp(self):
+        # cold start, nothing cached from previous runs
+        self.env = dict(os.environ,
+                        XDG_CONFIG_HOME=join(self.test_dir, "config"),
+                        XDG_CACHE_HOME=join(self.test_dir, "cache"),
+                        XDG_RUNTIME_DIR=join(self.test_dir, "runtime"))
+        for var in ("OVOS_CONFIG_BASE_FOLDER", "OVOS_CONFIG_FILENAME",
+                    "OVOS_DEFAULT_CONFIG"):
+            self.env.pop(var, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _run(self, *args) -> float:
+        start = time.perf_counter()
+        subprocess.check_output([sys.executable, "-m", "ovos_config", *args],
+                                env=self.env)
+        return time.perf_counter() - start
+
+    def test_import_loads_nothing(self):
+        out = subprocess.check_output([sys.executable, "-c", _IMPORT_CLI],
+                                      env=self.env)
+        result = json.loads(out)
+        self.assertEqual(result["loaded"], [])
+        self.assertFalse(result["combo_lock"])
+
+    def test_cli_latency(self):
+        for args in (["--help"], ["get", "-k", "lang"]):
+            elapsed = self._run(*args)
+            self.assertLess(elapsed, CLI_TIME_BUDGET,
+                            f"ovos-config {' '.join(args)} took {elapsed:.3f}s")
+
+    def test_set_many(self):
+        user_config = join(self.test_dir, "config", "mycroft", "mycroft.conf")
+        subprocess.check_output(
+            [sys.executable, "-m", "ovos_config", "set", "lang=pt-PT",
+             "/listener/sample_rate=8000", "confirm_listening=false",
+             "test/new={\"a\": [1]}"], env=self.env)
+        with open(user_config) as f:
+            conf = json.load(f)
+        self.assertEqual(conf, {"lang": "pt-PT",
+                                "listener": {"sample_rate": 8000},
+                                "confirm_listening": False,
+                                "test": {"new": {"a": [1]}}})
+
+        # patch file and pairs read from stdin
+        patch = join(self.test_dir, "patch.yaml")
+        with open(patch, "w") as f:
+            f.write("tts:\n  module: test\nlang: en-US\n")
+        subprocess.check_output(
+            [sys.executable, "-m", "ovos_config", "set", "-f", patch],
+            env=self.env)
+        subprocess.run(
+            [sys.executable, "-m", "ovos_config", "set", "-f", "-"],
+            input=b"# comment\nskills/blacklisted_skills=test.skill\n",
+            env=self.env, check=True, capture_output=True)
+        with open(user_config) as f:
+            conf = json.load(f)
+        self.assertEqual(conf["tts"], {"module": "test"})
+        self.assertEqual(conf["lang"], "en-US")
+        self.assertEqual(conf["skills"]["blacklisted_skills"], ["test.skill"])
+
+        # nothing is written if any value is invalid
+        result = subprocess.run(
+            [sys.executable, "-m", "ovos_config", "set", "lang=pt-PT",
+             "listener/sample_rate=fast"], env=self.env, capture_output=True)
+        self.assertNotEqual(result.returncode, 0)
+        with open(user_config) as f:
+            self.assertEqual(json.load(f), conf)
+
+        # a value can't be set below a key holding a value
+        result = subprocess.run(
+            [sys.executable, "-m", "ovos_config", "set", "lang/code=x"],
+            env=self.env, capture_output=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertNotIn(b"Traceback", result.stderr)
+        with open(user_config) as f:
+            self.assertEqual(json.load(f), conf)
@@ -38,6 +38,7 @@ class TestConfiguration(TestCase):
         from ovos_config.config import Configuration
         Configuration.load_config_stack([{}], True)
         Configuration._callbacks = []
+        Configuration._subscribers = []
 
     @patch('mycroft.api.DeviceApi')
     @skip("requires backend to be enabled, TODO refactor test!")
@@ -340,3 +341,572 @@ class TestConfiguration(TestCase):
         self.assertEqual(len(config._callbacks), 1)
         config.set_config_watcher(callback)
         self.assertEqual(len(config._callbacks), 1)
+
+    def test_merged_snapshot_generation(self):
+        from ovos_config.config import Configuration
+        config = Configuration()
+        config["lang"]
+        generation = Configuration.generation
+        merged = Configuration._get_merged()
+
+        # reads do not re-merge the stack
+        for _ in range(10):
+            config["lang"]
+            list(config.items())
+        self.assertEqual(Configuration.generation, generation)
+        self.assertIs(Configuration._get_merged(), merged)
+
+        # patching a layer invalidates the snapshot
+        config["test_generation"] = True
+        self.assertTrue(config["test_generation"])
+        self.assertGreater(Configuration.generation, generation)
+        self.assertTrue(Configuration()["test_generation"])
+
+        # replacing the patch layer invalidates the snapshot
+        generation = Configuration.generation
+        Configuration.patch_clear(None)
+        self.assertIsNone(Configuration()["test_generation"])
+        self.assertGreater(Configuration.generation, generation)
+
+    def test_patch_changed_keys(self):
+        from ovos_config.models import LocalConf
+        from ovos_config.config import Configuration
+        conf = LocalConf(None)
+        conf["a"] = 1
+        rev = conf.revision
+        conf["b"] = 2
+        conf.merge({"c": {"d": 3}})
+        del conf["a"]
+        self.assertEqual(conf.changed_keys(rev), {"a", "b", "c"})
+        self.assertEqual(conf.changed_keys(conf.revision), set())
+        rev = conf.revision
+        conf |= {"e": 1}
+        conf.popitem()
+        self.assertEqual(conf.changed_keys(rev), {"e"})
+
+        # tracking state survives pickling
+        import pickle
+        copied = pickle.loads(pickle.dumps(conf))
+        self.assertEqual(copied, conf)
+        self.assertEqual(copied.revision, conf.revision)
+        copied["f"] = 1
+        self.assertEqual(copied.changed_keys(conf.revision), {"f"})
+
+        merged = Configuration._get_merged()
+        # nothing changed, the published merge is returned as is
+        token = Configuration._get_change_token()
+        self.assertEqual(Configuration._published.token, token)
+        self.assertIs(Configuration._get_merged(), merged)
+        Configuration.patch(Mock(data={"config": {"location": {"city": "x"}}}))
+        new = Configuration._get_merged()
+        self.assertEqual(new["location"]["city"], "x")
+        # subtrees not touched by the patch are shared with the old merge
+        for k in ("stt", "tts", "listener", "skills"):
+            self.assertIs(new[k], merged[k])
+        Configuration.patch_clear(None)
+
+    def test_local_conf_hash(self):
+        from ovos_config.models import LocalConf
+        a = LocalConf(None)
+        a["x"] = {"y": 1, "z": [1, 2]}
+        a["w"] = "value"
+        b = LocalConf(None)
+        b["w"] = "value"
+        b["x"] = {"z": [1, 2], "y": 1}
+        self.assertEqual(hash(a), hash(b))
+
+        old = hash(a)
+        a.merge({"x": {"y": 2}})
+        self.assertNotEqual(hash(a), old)
+        a.merge({"x": {"y": 1}})
+        self.assertEqual(hash(a), old)
+
+        a["new"] = True
+        self.assertNotEqual(hash(a), old)
+        a.pop("new")
+        self.assertEqual(hash(a), old)
+        with patch("ovos_config.models.json.dumps") as dumps:
+            hash(a)
+            dumps.assert_not_called()
+
+        # loaded files are hashed from the digest of their contents
+        path = join(self.test_dir, "hash_test.json")
+        with open(path, "w") as f:
+            json.dump({"a": {"b": 1}, "c": 2}, f)
+        with patch("ovos_config.models.json.dumps") as dumps:
+            loaded = LocalConf(path)
+            old = hash(loaded)
+            self.assertEqual(hash(LocalConf(path)), old)
+            dumps.assert_not_called()
+        loaded["c"] = 3
+        self.assertNotEqual(hash(loaded), old)
+        with open(path, "w") as f:
+            json.dump({"a": {"b": 2}, "c": 2}, f)
+        other = LocalConf(path)
+        self.assertNotEqual(hash(other), old)
+
+    def test_reload_unchanged_contents(self):
+        from ovos_config.models import LocalConf
+        path = join(self.test_dir, "reload_test.json")
+        with open(path, "w") as f:
+            json.dump({"a": 1}, f)
+        conf = LocalConf(path)
+        self.assertEqual(conf, {"a": 1})
+
+        # same contents, new mtime
+        with open(path, "w") as f:
+            json.dump({"a": 1}, f)
+        os.utime(path, ns=(0, 10 ** 9))
+        with patch("ovos_config.models.load_commented_json") as loader:
+            conf.reload()
+            loader.assert_not_called()
+        rev = conf.revision
+
+        # not modified since the last reload
+        with patch("ovos_config.models.load_commented_json") as loader:
+            conf.reload()
+            loader.assert_not_called()
+        self.assertEqual(conf.revision, rev)
+
+        # contents changed
+        with open(path, "w") as f:
+            json.dump({"a": 2}, f)
+        conf.reload()
+        self.assertEqual(conf, {"a": 2})
+
+    def test_parse_cache(self):
+        from ovos_config.models import LocalConf, _get_parse_cache_path
+        path = join(self.test_dir, "parse_cache_test.conf")
+        with open(path, "w") as f:
+            f.write('// comment\n{"a": {"b": [1, 2]}}')
+        with patch.dict(os.environ, {"OVOS_CONFIG_PARSE_CACHE": "1",
+                                     "XDG_CACHE_HOME": self.test_dir}):
+            cache_path = _get_parse_cache_path(path)
+            self.assertEqual(LocalConf(path), {"a": {"b": [1, 2]}})
+            self.assertTrue(isfile(cache_path))
+
+            # warm start does not parse the file
+            with patch("ovos_config.models.load_commented_json") as loader:
+                self.assertEqual(LocalConf(path), {"a": {"b": [1, 2]}})
+                loader.assert_not_called()
+
+            # outdated cache entries are ignored
+            with open(path, "w") as f:
+                f.write('{"a": 1}')
+            self.assertEqual(LocalConf(path), {"a": 1})
+
+        # cache is opt-in
+        os.remove(cache_path)
+        self.assertEqual(LocalConf(path), {"a": 1})
+        self.assertFalse(isfile(cache_path))
+
+    def test_lazy_layers(self):
+        from ovos_config.config import _LazyLayer
+        factory = Mock(return_value={"loaded": True})
+
+        class Namespace:
+            layer = _LazyLayer(factory)
+
+        factory.assert_not_called()
+        self.assertEqual(Namespace.layer, {"loaded": True})
+        self.assertEqual(Namespace().layer, {"loaded": True})
+        factory.assert_called_once()
+        # descriptor replaced by the loaded value
+        self.assertEqual(Namespace.__dict__["layer"], {"loaded": True})
+
+        # explicit assignment still overrides the layer
+        Namespace.layer = {"loaded": False}
+        self.assertEqual(Namespace.layer, {"loaded": False})
+        factory.assert_called_once()
+
+    def test_snapshot(self):
+        import copy
+        from ovos_config.config import Configuration
+        from ovos_config.frozen import FrozenDict
+        snapshot = Configuration.snapshot()
+        self.assertIsInstance(snapshot, FrozenDict)
+        self.assertEqual(json.loads(json.dumps(snapshot)),
+                         json.loads(json.dumps(Configuration())))
+        # cached until the configuration changes
+        self.assertIs(Configuration.snapshot(), snapshot)
+        self.assertIs(copy.deepcopy(snapshot), snapshot)
+        hash(snapshot)
+
+        with self.assertRaises(TypeError):
+            snapshot["lang"] = "pt-pt"
+        with self.assertRaises(TypeError):
+            snapshot["location"].update({"city": None})
+        self.assertIsInstance(snapshot["hotwords"]["hey_mycroft"],
+                              FrozenDict)
+
+        Configuration.patch(Mock(data={"config": {"lang": "pt-pt"}}))
+        new = Configuration.snapshot()
+        self.assertIsNot(new, snapshot)
+        self.assertEqual(new["lang"], "pt-pt")
+        self.assertNotEqual(hash(new), hash(snapshot))
+        # unchanged sections are shared between snapshots
+        self.assertIs(new["location"], snapshot["location"])
+        Configuration.patch_clear(None)
+
+    def test_system_constraints(self):
+        from ovos_config.config import Configuration, SystemConstraints
+        from ovos_config.models import LocalConf
+        constraints = Configuration.get_constraints()
+        self.assertIsInstance(constraints, SystemConstraints)
+        # resolved once per change of the layers defining them
+        self.assertIs(Configuration.get_constraints(), constraints)
+        # callers can not modify the layer data
+        Configuration.get_system_constraints()["disable_user_config"] = True
+        self.assertIs(Configuration.get_constraints(), constraints)
+        self.assertTrue(constraints.is_enabled("user"))
+
+        system = Configuration.system
+        try:
+            conf = LocalConf(None)
+            conf["system"] = {"disable_remote_config": True,
+                              "protected_keys": {"user": ["lang"]}}
+            Configuration.system = conf
+            new = Configuration.get_constraints()
+            self.assertIsNot(new, constraints)
+            self.assertFalse(new.is_enabled("remote"))
+            self.assertTrue(new.is_enabled("user"))
+            self.assertTrue(new.get_protected_keys("user")["lang"])
+            self.assertEqual(new.get_protected_keys("system"), {})
+
+            # modifying the layer invalidates the cached constraints
+            conf["system"] = {"disable_user_config": True}
+            new = Configuration.get_constraints()
+            self.assertFalse(new.is_enabled("user"))
+            self.assertFalse(new.is_enabled("remote"))
+            self.assertTrue(new.is_enabled("system"))
+        finally:
+            Configuration.system = system
+
+    def test_filter_and_merge_layers(self):
+        from ovos_config.config import Configuration, ConfigLayer
+        user = {"lang": "pt-pt", "tts": {"module": "test"}}
+        configs = [{"lang": "en-us", "tts": {"module": "x", "a": 1}}, user]
+        merged = Configuration.filter_and_merge(configs)
+        self.assertEqual(merged, {"lang": "pt-pt",
+                                  "tts": {"module": "test", "a": 1}})
+        # plain dicts are merged as they are, the input is not modified
+        self.assertIs(configs[1], user)
+        self.assertEqual(user, {"lang": "pt-pt", "tts": {"module": "test"}})
+
+        layer = Configuration.describe_layer(user)
+        self.assertIsInstance(layer, ConfigLayer)
+        self.assertIs(layer.config, user)
+        self.assertIsNone(layer.path)
+        self.assertEqual(layer.kind, "user")
+        self.assertFalse(layer.read_only)
+        self.assertIs(Configuration.describe_layer(layer), layer)
+
+        layer = Configuration.describe_layer(Configuration.default)
+        self.assertEqual(layer.kind, "system")
+        self.assertTrue(layer.read_only)
+        self.assertEqual(layer.path, Configuration.default.path)
+
+    def test_merge_shares_read_only_layers(self):
+        from ovos_config.config import Configuration, ConfigLayer
+        default = {"tts": {"module": "a", "a": {}}, "stt": {"module": "b"}}
+        user = {"tts": {"module": "c"}, "lang": {"code": "pt-pt"}}
+        merged = Configuration.filter_and_merge(
+            [ConfigLayer(default, kind="system", read_only=True), user])
+        self.assertEqual(merged, {"tts": {"module": "c", "a": {}},
+                                  "stt": {"module": "b"},
+                                  "lang": {"code": "pt-pt"}})
+        # subtrees not overridden are shared with the read only layer
+        self.assertIs(merged["stt"], default["stt"])
+        self.assertIs(merged["tts"]["a"], default["tts"]["a"])
+        self.assertIsNot(merged["tts"], default["tts"])
+        # other layers are still copied
+        self.assertIsNot(merged["lang"], user["lang"])
+        self.assertEqual(default["tts"]["module"], "a")
+
+    def test_get_path(self):
+        from ovos_config.config import Configuration
+        merged = Configuration._get_merged()
+        self.assertEqual(Configuration.get_path("location/timezone/code"),
+                         merged["location"]["timezone"]["code"])
+        self.assertIs(Configuration.get_path("location"), merged["location"])
+        self.assertIsNone(Configuration.get_path("location/missing/code"))
+        self.assertIsNone(Configuration.get_path("lang/code"))
+        self.assertEqual(Configuration.get_path("missing", default=5), 5)
+        self.assertEqual(Configuration.get_path("location:timezone:offset",
+                                                separator=":"),
+                         merged["location"]["timezone"]["offset"])
+
+        # type coercion
+        self.assertEqual(Configuration.get_path("websocket/port", coerce=str),
+                         str(merged["websocket"]["port"]))
+        self.assertEqual(Configuration.get_path("lang", default=1,
+                                                coerce=int), 1)
+
+        # memo is invalidated when the configuration changes
+        Configuration.patch(Mock(data={"config": {"test_path": {"a": 1}}}))
+        self.assertEqual(Configuration.get_path("test_path/a"), 1)
+        Configuration.patch(Mock(data={"config": {"test_path": {"a": 2}}}))
+        self.assertEqual(Configuration.get_path("test_path/a"), 2)
+
+        self.assertEqual(
+            Configuration.get_many(["test_path/a", "test_path/b", "lang"],
+                                   defaults={"test_path/b": "x"},
+                                   coerce={"test_path/a": float}),
+            {"test_path/a": 2.0, "test_path/b": "x", "lang": merged["lang"]})
+        Configuration.patch_clear(None)
+        self.assertIsNone(Configuration.get_path("test_path/a"))
+
+    def test_store_atomic(self):
+        from ovos_config.models import LocalConf
+        path = join(self.test_dir, "store", "atomic.conf")
+        conf = LocalConf(None)
+        conf["a"] = {"b": 1}
+        conf.store(path)
+        os.chmod(path, 0o640)
+        conf["a"] = {"b": 2}
+        with patch("ovos_config.models.os.replace",
+                   side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                conf.store(path)
+        # failed store leaves the previous file intact and no temp file
+        self.assertEqual(LocalConf(path), {"a": {"b": 1}})
+        self.assertEqual(os.listdir(dirname(path)), ["atomic.conf"])
+
+        conf.store(path)
+        self.assertEqual(LocalConf(path), {"a": {"b": 2}})
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(dirname(path)), ["atomic.conf"])
+
+        # a symlinked config is written through the link
+        link = join(self.test_dir, "store", "link.conf")
+        os.symlink(path, link)
+        conf["a"] = {"b": 3}
+        conf.store(link)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(LocalConf(path), {"a": {"b": 3}})
+        os.remove(link)
+
+    def test_store_delayed(self):
+        import ovos_config.models
+        from ovos_config.models import LocalConf, flush_pending_stores
+        path = join(self.test_dir, "store", "delayed.yml")
+        write = Mock(side_effect=ovos_config.models._write_config_file)
+        with patch("ovos_config.models._write_config_file", write):
+            for i in range(5):
+                conf = LocalConf(path)
+                conf[f"key_{i}"] = i
+                conf.store(delay=60)
+            write.assert_not_called()
+            self.assertFalse(isfile(path))
+            # later stores are coalesced into a single write
+            flush_pending_stores()
+            write.assert_called_once()
+            self.assertEqual(LocalConf(path),
+                             {f"key_{i}": i for i in range(5)})
+
+            # a direct store supersedes a pending one
+            conf.store(delay=60)
+            conf["key_0"] = -1
+            conf.store()
+            self.assertEqual(write.call_count, 2)
+            flush_pending_stores()
+            self.assertEqual(write.call_count, 2)
+            self.assertEqual(LocalConf(path)["key_0"], -1)
+
+            # written once the delay expires
+            conf["key_0"] = 0
+            conf.store(delay=0.05)
+            sleep(0.5)
+            self.assertEqual(write.call_count, 3)
+            self.assertEqual(LocalConf(path)["key_0"], 0)
+
+    def test_file_event_debounce(self):
+        from ovos_config.config import Configuration
+        called = Event()
+        on_file_change = Mock(side_effect=lambda *paths: called.set())
+        stats = Configuration.get_file_event_stats()
+        with patch.object(Configuration, "_on_file_change", on_file_change), \
+                patch.object(Configuration, "_debounce", 0.2):
+            # bursts of events for several files are handled together
+            for _ in range(5):
+                Configuration._on_file_event("/a.conf")
+            for _ in range(3):
+                Configuration._on_file_event("/b.conf")
+            on_file_change.assert_not_called()
+            self.assertTrue(called.wait(2))
+            on_file_change.assert_called_once_with("/a.conf", "/b.conf")
+            new_stats = Configuration.get_file_event_stats()
+            self.assertEqual(new_stats["received"] - stats["received"], 8)
+            self.assertEqual(new_stats["suppressed"] - stats["suppressed"], 7)
+            self.assertEqual(new_stats["handled"] - stats["handled"], 1)
+
+            # events received during a reload are handled after it
+            running = []
+            overlaps = []
+            done = Event()
+
+            def slow_change(*paths):
+                running.append(paths)
+                overlaps.append(len(running))
+                sleep(0.3)
+                running.remove(paths)
+                if "/c.conf" in paths:
+                    done.set()
+
+            on_file_change.side_effect = slow_change
+            on_file_change.reset_mock()
+            Configuration._debounce = 0.05
+            Configuration._on_file_event("/a.conf")
+            sleep(0.15)
+            Configuration._on_file_event("/c.conf")
+            self.assertTrue(done.wait(2))
+            self.assertEqual(overlaps, [1, 1])
+            self.assertEqual([c.args for c in on_file_change.call_args_list],
+                             [("/a.conf",), ("/c.conf",)])
+
+            # no debounce
+            on_file_change.side_effect = None
+            on_file_change.reset_mock()
+            Configuration._debounce = 0
+            Configuration._on_file_event("/a.conf")
+            Configuration._on_file_event("/a.conf")
+            self.assertEqual(on_file_change.call_count, 2)
+
+    def test_subscribe(self):
+        import ovos_config
+        importlib.reload(ovos_config.config)
+        from ovos_config.config import Configuration
+        from ovos_config.diff import ConfigChange
+        test_file = join(self.test_dir, "mycroft", "mycroft.conf")
+        with open(test_file, 'w') as f:
+            json.dump({"testing": True, "listener": {"sample_rate": 1}}, f)
+        Configuration.reload()
+        self.assertTrue(Configuration()["testing"])
+
+        everything = Mock()
+        listener = Mock()
+        tts = Mock()
+        with patch.object(Configuration, "set_config_watcher"):
+            Configuration.subscribe(everything)
+            Configuration.subscribe(listener, ["listener"])
+            Configuration.subscribe(tts, ["tts"])
+            # subscribing again replaces the previous prefixes
+            Configuration.subscribe(listener, ["listener/sample_rate"])
+        self.assertEqual(len(Configuration._subscribers), 3)
+
+        with open(test_file, 'w') as f:
+            json.dump({"testing": False, "listener": {"sample_rate": 2}}, f)
+        Configuration._on_file_change(test_file)
+        self.assertTrue(Configuration.wait_for_callbacks(2))
+        everything.assert_called_once_with(
+            [ConfigChange("listener/sample_rate", 1, 2),
+             ConfigChange("testing", True, False)])
+        listener.assert_called_once_with(
+            [ConfigChange("listener/sample_rate", 1, 2)])
+        tts.assert_not_called()
+
+        Configuration.unsubscribe(everything)
+        with open(test_file, 'w') as f:
+            json.dump({"testing": True, "listener": {"sample_rate": 3}}, f)
+        Configuration._on_file_change(test_file)
+        self.assertTrue(Configuration.wait_for_callbacks(2))
+        everything.assert_called_once()
+        self.assertEqual(listener.call_count, 2)
+        with open(test_file, 'w') as f:
+            f.write('{"testing": true}')
+
+    def test_async_api(self):
+        import asyncio
+        import ovos_config
+        importlib.reload(ovos_config.config)
+        from ovos_config.config import Configuration
+        from ovos_config.diff import ConfigChange
+        from ovos_config.models import LocalConf
+        test_file = join(self.test_dir, "mycroft", "mycroft.conf")
+
+        async def _test():
+            conf = LocalConf(test_file)
+            conf["testing"] = True
+            await conf.astore()
+            await Configuration.areload()
+            self.assertTrue(Configuration()["testing"])
+
+            with patch.object(Configuration, "set_config_watcher"):
+                changes = Configuration.watch(["testing"])
+                next_change = asyncio.ensure_future(changes.__anext__())
+                # let the generator subscribe
+                await asyncio.sleep(0)
+                self.assertEqual(len(Configuration._subscribers), 1)
+
+                conf["testing"] = False
+                await conf.astore()
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    None, Configuration._on_file_change, test_file)
+                change = await asyncio.wait_for(next_change, 2)
+                self.assertEqual(change, ConfigChange("testing", True, False))
+                await changes.aclose()
+                self.assertEqual(Configuration._subscribers, [])
+
+        asyncio.run(_test())
+        with open(test_file, 'w') as f:
+            f.write('{"testing": true}')
+
+    def test_concurrent_reads(self):
+        from ovos_config.config import Configuration
+        Configuration.patch_clear(None)
+        stop = Event()
+        errors = []
+        reads = []
+
+        def reader():
+            count = 0
+            try:
+                while not stop.is_set():
+                    merged = Configuration._get_merged()
+                    # a writer never publishes a half applied patch
+                    self.assertEqual(merged.get("rcu_a"), merged.get("rcu_b"))
+                    Configuration.get_path("rcu_a")
+                    snap = Configuration.snapshot()
+                    self.assertEqual(snap.get("rcu_a"), snap.get("rcu_b"))
+                    count += 1
+            except Exception as e:
+                errors.append(e)
+            reads.append(count)
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                message = Mock(data={"config": {"rcu_a": i, "rcu_b": i}})
+                Configuration.patch(message)
+                if i % 100 == 0:
+                    Configuration.patch_clear(None)
+
+        threads = [Thread(target=reader) for _ in range(4)]
+        threads.append(Thread(target=writer))
+        for t in threads:
+            t.start()
+        sleep(1)
+        stop.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        LOG.debug(f"{sum(reads)} reads/s with 4 readers and a patch writer")
+        Configuration.patch_clear(None)
+
+    def test_patch_copy_changed_keys(self):
+        from ovos_config.config import Configuration
+        Configuration.patch_clear(None)
+        Configuration.patch(Mock(data={"config": {"patch_a": 1}}))
+        Configuration._get_merged()
+        old_state = Configuration._published.state[-1]
+        Configuration.patch(Mock(data={"config": {"patch_b": 2}}))
+        layers = Configuration._get_layers()
+        new_state = Configuration._get_layer_states(layers)[-1]
+        # the patch is copied on write but only the new key is merged again
+        self.assertEqual(Configuration._get_changed_keys(
+            layers[-1], old_state, new_state), {"patch_b"})
+        self.assertEqual(Configuration._get_merged()["patch_a"], 1)
+        self.assertEqual(Configuration._get_merged()["patch_b"], 2)
+        Configuration.patch_clear(None)
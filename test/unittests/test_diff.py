@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+
+class TestDiff(TestCase):
+    def test_diff_configs(self):
+        from ovos_config.diff import ConfigChange, diff_configs
+        shared = {"x": [1, 2]}
+        old = {"lang": "en-us", "shared": shared,
+               "listener": {"VAD": {"module": "a", "threshold": 1},
+                            "sample_rate": 16000},
+               "removed": {"a": 1}}
+        new = {"lang": "en-us", "shared": shared,
+               "listener": {"VAD": {"module": "b", "threshold": 1},
+                            "sample_rate": 16000, "mute": True},
+               "added": 1}
+        self.assertEqual(diff_configs(old, new), [
+            ConfigChange("listener/VAD/module", "a", "b"),
+            ConfigChange("listener/mute", None, True),
+            ConfigChange("removed", {"a": 1}, None),
+            ConfigChange("added", None, 1)])
+        self.assertEqual(diff_configs(old, old), [])
+        self.assertEqual(diff_configs({"a": {"b": 1}}, {"a": 1}, ":"),
+                         [ConfigChange("a", {"b": 1}, 1)])
+        self.assertEqual(diff_configs({"a": {"b": 1}}, {"a": {"c": 1}}, ":"),
+                         [ConfigChange("a:b", 1, None),
+                          ConfigChange("a:c", None, 1)])
+
+    def test_filter_changes(self):
+        from ovos_config.diff import ConfigChange, filter_changes
+        changes = [ConfigChange("listener/VAD/module", "a", "b"),
+                   ConfigChange("listener", None, {}),
+                   ConfigChange("lang", "en-us", "pt-pt"),
+                   ConfigChange("listener_x", 1, 2)]
+        self.assertEqual(filter_changes(changes), changes)
+        self.assertEqual(filter_changes(changes, []), [])
+        self.assertEqual(filter_changes(changes, ["listener"]), changes[:2])
+        # changes of a parent section affect the prefix too
+        self.assertEqual(filter_changes(changes, ["/listener/VAD/"]),
+                         changes[:2])
+        self.assertEqual(filter_changes(changes, ["listener/mute"]),
+                         changes[1:2])
+        self.assertEqual(filter_changes(changes, ["lang", "tts"]),
+                         changes[2:3])
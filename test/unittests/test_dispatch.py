@@ -0,0 +1,51 @@
+from threading import Event
+from time import sleep
+from unittest import TestCase
+from unittest.mock import Mock
+
+
+class TestCallbackDispatcher(TestCase):
+    def test_dispatch(self):
+        from ovos_config.dispatch import CallbackDispatcher
+        dispatcher = CallbackDispatcher(max_workers=2, timeout=0.05)
+        release = Event()
+        order = []
+
+        def slow(i):
+            release.wait(2)
+            order.append(("slow", i))
+
+        fast = Mock(side_effect=lambda i: order.append(("fast", i)))
+        for i in range(3):
+            dispatcher.dispatch("slow", slow, i)
+            dispatcher.dispatch("fast", fast, i)
+        # a slow callback does not delay the other subscribers
+        sleep(0.2)
+        self.assertEqual(fast.call_count, 3)
+        self.assertFalse(dispatcher.wait(0.01))
+        release.set()
+        self.assertTrue(dispatcher.wait(2))
+        # calls of each subscriber run in order
+        self.assertEqual([o for o in order if o[0] == "slow"],
+                         [("slow", 0), ("slow", 1), ("slow", 2)])
+        self.assertEqual([o for o in order if o[0] == "fast"],
+                         [("fast", 0), ("fast", 1), ("fast", 2)])
+
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats["fast"]["calls"], 3)
+        self.assertEqual(stats["fast"]["timeouts"], 0)
+        self.assertEqual(stats["slow"]["calls"], 3)
+        self.assertGreaterEqual(stats["slow"]["timeouts"], 1)
+        self.assertGreaterEqual(stats["slow"]["max_latency"], 0.05)
+        dispatcher.shutdown()
+
+    def test_errors_and_inline(self):
+        from ovos_config.dispatch import CallbackDispatcher
+        dispatcher = CallbackDispatcher(max_workers=0)
+        failing = Mock(side_effect=RuntimeError)
+        dispatcher.dispatch(failing, failing, 1)
+        # no thread pool, the callback already ran
+        failing.assert_called_once_with(1)
+        self.assertIsNone(dispatcher._executor)
+        self.assertEqual(dispatcher.get_stats()[failing]["errors"], 1)
+        self.assertTrue(dispatcher.wait(0))
@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+# generous upper bound for `import ovos_config` in a fresh interpreter,
+# meant to catch heavy imports sneaking back in rather than to benchmark
+IMPORT_TIME_BUDGET = 0.5
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import ovos_config
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed,
+                  "modules": [m for m in ("yaml", "combo_lock", "watchdog",
+                                          "ovos_utils.file_utils")
+                              if m in sys.modules]}))
+"""
+
+
+class TestImport(TestCase):
+    def test_import_time(self):
+        out = subprocess.check_output([sys.executable, "-c", _MEASURE])
+        result = json.loads(out)
+        # heavy dependencies are only imported on first use
+        self.assertEqual(result["modules"], [])
+        self.assertLess(result["elapsed"], IMPORT_TIME_BUDGET)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+
+def _walk(dic, parts, absolute, only_endpoints, path=()):
+    """ recursive reference implementation of KeyPathIndex.search """
+    for k, v in dic.items():
+        p = path + (k,)
+        if not (only_endpoints and isinstance(v, dict)) and \
+                not (absolute and len(p) != len(parts)) and \
+                len(p) >= len(parts) and \
+                all(a.lower() in b.lower()
+                    for a, b in zip(parts, p[-len(parts):])):
+            yield "/".join(p), v
+        if isinstance(v, dict):
+            yield from _walk(v, parts, absolute, only_endpoints, p)
+
+
+class TestKeyPathIndex(TestCase):
+    config = {"lang": "en-us",
+              "tts": {"module": "a", "fallback_module": "b",
+                      "a": {"Voice": "x", "module_opts": {}}},
+              "listener": {"wake_word": "hey", "VAD": {"module": "v"}},
+              "hotwords": {"hey": {"module": "w", "listen": True}}}
+
+    def test_search(self):
+        from ovos_config.index import KeyPathIndex
+        index = KeyPathIndex(self.config)
+        self.assertEqual(len(index), 15)
+        self.assertEqual(list(index.search("/tts/module")),
+                         [("tts/module", "a"),
+                          ("tts/fallback_module", "b")])
+        self.assertEqual(list(index.search("voice")), [("tts/a/Voice", "x")])
+        self.assertEqual(list(index.search("nothing")), [])
+        # same results and order as a recursive walk
+        for key in ("module", "/module", "tts/mod", "/tts/a", "a/", "",
+                    "vad/MODULE", "hey", "/hotwords/hey/listen", "o/e"):
+            for only_endpoints in (False, True):
+                absolute = key.startswith("/")
+                parts = (key[1:] if absolute else key).split("/")
+                self.assertEqual(
+                    list(index.search(key, only_endpoints)),
+                    list(_walk(self.config, parts, absolute, only_endpoints)),
+                    key)
+
+    def test_get_and_prefix(self):
+        from ovos_config.index import KeyPathIndex
+        index = KeyPathIndex(self.config)
+        self.assertEqual(index.get("/tts/a/voice"), "x")
+        self.assertIs(index.get("tts/a"), self.config["tts"]["a"])
+        self.assertIsNone(index.get("tts/missing"))
+        self.assertEqual(index.get("tts/missing", 1), 1)
+        self.assertEqual([p for p, _ in index.prefix("tts/")],
+                         ["tts/module", "tts/fallback_module", "tts/a",
+                          "tts/a/Voice", "tts/a/module_opts"])
+        self.assertEqual([p for p, _ in index.prefix("/tts/a/", True)],
+                         ["tts/a/Voice"])
+        self.assertEqual(list(index.prefix("zzz")), [])
+
+    def test_configuration_index(self):
+        from ovos_config.config import Configuration
+        index = Configuration.get_key_index()
+        # built once per merged generation
+        self.assertIs(Configuration.get_key_index(), index)
+        merged = Configuration._get_merged()
+        self.assertEqual(list(index.search("lang", True)),
+                         list(_walk(merged, ["lang"], False, True)))
+        self.assertEqual(index.get("/tts/module"), merged["tts"]["module"])
@@ -0,0 +1,58 @@
+from threading import Event, Thread
+from unittest import TestCase
+
+
+class TestConfigFileLock(TestCase):
+    def _hold(self, lock_context, acquired: Event, release: Event) -> Thread:
+        def hold():
+            with lock_context():
+                acquired.set()
+                release.wait(5)
+        t = Thread(target=hold)
+        t.start()
+        return t
+
+    def test_get_file_lock(self):
+        from ovos_config.locks import get_file_lock
+        lock = get_file_lock("/tmp/ovos_test/../ovos_test/a.conf")
+        self.assertIs(get_file_lock("/tmp/ovos_test/a.conf"), lock)
+        self.assertIsNot(get_file_lock("/tmp/ovos_test/b.conf"), lock)
+        self.assertNotEqual(lock.lock_path,
+                            get_file_lock("/tmp/ovos_test/b.conf").lock_path)
+
+    def test_readers_share(self):
+        from ovos_config.locks import get_file_lock
+        lock = get_file_lock("/tmp/ovos_test/shared.conf")
+        acquired, release = Event(), Event()
+        t = self._hold(lock.read, acquired, release)
+        self.assertTrue(acquired.wait(5))
+        second, second_release = Event(), Event()
+        t2 = self._hold(lock.read, second, second_release)
+        # a second reader does not wait for the first one
+        self.assertTrue(second.wait(5))
+        release.set()
+        second_release.set()
+        t.join()
+        t2.join()
+
+    def test_writer_excludes(self):
+        from ovos_config.locks import get_file_lock
+        lock = get_file_lock("/tmp/ovos_test/exclusive.conf")
+        other = get_file_lock("/tmp/ovos_test/other.conf")
+        acquired, release = Event(), Event()
+        t = self._hold(lock.write, acquired, release)
+        self.assertTrue(acquired.wait(5))
+
+        reader, reader_release = Event(), Event()
+        t2 = self._hold(lock.read, reader, reader_release)
+        self.assertFalse(reader.wait(0.2))
+        # other files are not blocked
+        with other.read():
+            pass
+        with other.write():
+            pass
+        release.set()
+        self.assertTrue(reader.wait(5))
+        reader_release.set()
+        t.join()
+        t2.join()
@@ -0,0 +1,127 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+
+class TestMerge(TestCase):
+    def test_merge_layer(self):
+        from ovos_config.merge import merge_layer
+        base = {"a": {"b": 1, "c": {"d": 2}}, "e": {"f": 3}, "g": 4}
+        delta = {"a": {"b": 2}, "g": {"h": 5}, "i": {"j": 6}}
+        merged = merge_layer(base, delta)
+        self.assertEqual(merged, {"a": {"b": 2, "c": {"d": 2}},
+                                  "e": {"f": 3},
+                                  "g": {"h": 5},
+                                  "i": {"j": 6}})
+        # inputs are not modified
+        self.assertEqual(base, {"a": {"b": 1, "c": {"d": 2}},
+                                "e": {"f": 3}, "g": 4})
+        self.assertEqual(delta, {"a": {"b": 2}, "g": {"h": 5},
+                                 "i": {"j": 6}})
+        # untouched subtrees are shared, touched ones are copied
+        self.assertIs(merged["e"], base["e"])
+        self.assertIs(merged["a"]["c"], base["a"]["c"])
+        self.assertIsNot(merged["a"], base["a"])
+        self.assertIsNot(merged["i"], delta["i"])
+
+    def test_merge_layer_shared(self):
+        from ovos_config.merge import compile_key_paths, merge_layer
+        base = {"a": {"b": 1}}
+        delta = {"a": {"c": 2}, "d": {"e": {"f": 3}}, "g": {"h": 4}}
+        merged = merge_layer(base, delta, compile_key_paths(("g:h",)),
+                             share=True)
+        self.assertEqual(merged, {"a": {"b": 1, "c": 2},
+                                  "d": {"e": {"f": 3}}, "g": {}})
+        # subtrees only defined by delta are referenced, not copied
+        self.assertIs(merged["d"], delta["d"])
+        # merged or filtered subtrees are still copies
+        self.assertIsNot(merged["a"], delta["a"])
+        self.assertEqual(delta["g"], {"h": 4})
+        self.assertEqual(base, {"a": {"b": 1}})
+
+    def test_layered_merge(self):
+        from ovos_config.merge import LayeredMerge
+        layers = [{"a": 1, "b": {"c": 1}}, None, {"b": {"d": 2}}, {"a": 3}]
+        get_layer = Mock(side_effect=lambda idx: layers[idx])
+        stack = LayeredMerge()
+        self.assertEqual(stack.merged, {})
+
+        merged = stack.update([0, 0, 0, 0], get_layer)
+        self.assertEqual(merged, {"a": 3, "b": {"c": 1, "d": 2}})
+        self.assertEqual(get_layer.call_count, 4)
+
+        # nothing changed
+        get_layer.reset_mock()
+        self.assertIs(stack.update([0, 0, 0, 0], get_layer), merged)
+        get_layer.assert_not_called()
+
+        # only the changed layer and the ones above it are merged again
+        layers[2] = {"b": {"d": 5}}
+        merged = stack.update([0, 0, 1, 0], get_layer)
+        self.assertEqual(merged, {"a": 3, "b": {"c": 1, "d": 5}})
+        self.assertEqual([c.args[0] for c in get_layer.call_args_list],
+                         [2, 3])
+
+        # top layer change
+        get_layer.reset_mock()
+        layers[3] = {"a": 4}
+        merged = stack.update([0, 0, 1, 1], get_layer)
+        self.assertEqual(merged, {"a": 4, "b": {"c": 1, "d": 5}})
+        get_layer.assert_called_once_with(3)
+
+        # layer added on top
+        get_layer.reset_mock()
+        layers.append({"e": True})
+        merged = stack.update([0, 0, 1, 1, 0], get_layer)
+        self.assertTrue(merged["e"])
+        get_layer.assert_called_once_with(4)
+
+    def test_layered_merge_changed_keys(self):
+        from ovos_config.merge import LayeredMerge
+        layers = [{"a": {"x": 1}, "b": {"c": 1}}, {"b": {"d": 2}}, {}]
+        stack = LayeredMerge()
+        merged = stack.update([0, 0, 0], lambda idx: layers[idx])
+
+        # top layer sets a key
+        layers[2] = {"b": {"c": 5}}
+        new = stack.update([0, 0, 1], lambda idx: layers[idx],
+                           lambda idx, old: {"b"})
+        self.assertEqual(new, {"a": {"x": 1}, "b": {"c": 5, "d": 2}})
+        # untouched subtrees are not merged again
+        self.assertIs(new["a"], merged["a"])
+
+        # middle layer removes a key, change propagates to the top
+        layers[1] = {}
+        new = stack.update([0, 1, 1], lambda idx: layers[idx],
+                           lambda idx, old: {"b"})
+        self.assertEqual(new, {"a": {"x": 1}, "b": {"c": 5}})
+
+        # top layer removes a key
+        layers[2] = {}
+        new = stack.update([0, 1, 2], lambda idx: layers[idx],
+                           lambda idx, old: {"b"})
+        self.assertEqual(new, {"a": {"x": 1}, "b": {"c": 1}})
+
+        # unknown changes merge the whole layer
+        layers[2] = {"z": 1}
+        new = stack.update([0, 1, 3], lambda idx: layers[idx],
+                           lambda idx, old: None)
+        self.assertEqual(new, {"a": {"x": 1}, "b": {"c": 1}, "z": 1})
+
+    def test_protected_keys(self):
+        from ovos_config.merge import PROTECTED, compile_key_paths, \
+            merge_layer
+        trie = compile_key_paths(("a:b", "c", "a:d:e", "c:f"))
+        self.assertEqual(trie, {"a": {"b": PROTECTED, "d": {"e": PROTECTED}},
+                                "c": PROTECTED})
+        # compiled once
+        self.assertIs(compile_key_paths(("a:b", "c", "a:d:e", "c:f")), trie)
+
+        base = {"a": {"b": 1, "x": 1}, "c": 1}
+        delta = {"a": {"b": 2, "x": 2, "d": {"e": 2, "g": 2}},
+                 "c": {"f": 2}, "h": 2}
+        merged = merge_layer(base, delta, trie)
+        self.assertEqual(merged, {"a": {"b": 1, "x": 2, "d": {"g": 2}},
+                                  "c": 1, "h": 2})
+        # layer is not modified
+        self.assertEqual(delta["a"]["b"], 2)
+        self.assertEqual(delta["c"], {"f": 2})
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+from os.path import dirname, join
+from unittest import TestCase
+
+_READ_CONFIG = """
+import json, sys
+from ovos_config.config import Configuration
+lang = Configuration()["lang"]
+print(json.dumps({"lang": lang,
+                  "loaded": Configuration._get_loaded_layer("default") is not None,
+                  "version": Configuration._get_shared_snapshot().version}))
+"""
+
+_WATCH_CONFIG = """
+import json
+from unittest.mock import patch
+from ovos_config.config import Configuration
+with patch("ovos_utils.file_utils.FileWatcher"):
+    Configuration.set_config_watcher()
+lang = Configuration()["lang"]
+print(json.dumps({"lang": lang,
+                  "loaded": [n for n in ("default", "remote", "distribution",
+                                         "system", "xdg_configs")
+                             if Configuration._get_loaded_layer(n) is not None]}))
+"""
+
+
+class TestSharedSnapshot(TestCase):
+    test_dir = join(dirname(__file__), "test_config", "shared")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_read_write(self):
+        from ovos_config.shared import SharedSnapshot
+        snapshot = SharedSnapshot(join(self.test_dir, "test.snapshot"))
+        self.assertEqual(snapshot.version, 0)
+        self.assertIsNone(snapshot.read())
+
+        key = b"k" * 16
+        self.assertEqual(snapshot.write(key, {"a": {"b": [1, 2]}}), 2)
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(snapshot.read(), (key, {"a": {"b": [1, 2]}}))
+        # unchanged snapshot is not unmarshalled again
+        self.assertIs(snapshot.read()[1], snapshot.read()[1])
+
+        # a second mapping sees updates, including ones that grow the file
+        other = SharedSnapshot(snapshot.path)
+        self.assertEqual(other.read(), (key, {"a": {"b": [1, 2]}}))
+        data = {"a": "x" * 10000}
+        self.assertEqual(snapshot.write(b"n" * 16, data), 4)
+        self.assertEqual(other.read(), (b"n" * 16, data))
+        # and ones that shrink it
+        self.assertEqual(snapshot.write(key, {}), 6)
+        self.assertEqual(other.read(), (key, {}))
+
+    def test_interrupted_write(self):
+        from ovos_config.shared import SharedSnapshot, _HEADER, _MAGIC
+        snapshot = SharedSnapshot(join(self.test_dir, "test.snapshot"))
+        snapshot.write(b"k" * 16, {"a": 1})
+        # simulate a writer that died mid write
+        with open(snapshot.path, "r+b") as f:
+            f.write(_HEADER.pack(_MAGIC, 3, 0, b""))
+        reader = SharedSnapshot(snapshot.path)
+        self.assertIsNone(reader.read(retries=2))
+        self.assertEqual(snapshot.write(b"k" * 16, {"a": 2}), 6)
+        self.assertEqual(reader.read(), (b"k" * 16, {"a": 2}))
+
+    def test_shared_between_processes(self):
+        env = dict(os.environ,
+                   OVOS_CONFIG_SHARED_SNAPSHOT="1",
+                   XDG_CONFIG_HOME=join(self.test_dir, "config"),
+                   XDG_RUNTIME_DIR=join(self.test_dir, "runtime"))
+        for var in ("OVOS_CONFIG_BASE_FOLDER", "OVOS_CONFIG_FILENAME",
+                    "OVOS_DEFAULT_CONFIG"):
+            env.pop(var, None)
+        # first process loads the config files and publishes the snapshot
+        first = json.loads(subprocess.check_output(
+            [sys.executable, "-c", _READ_CONFIG], env=env))
+        self.assertTrue(first["loaded"])
+        self.assertGreater(first["version"], 0)
+        # second process reads the snapshot without loading any file
+        second = json.loads(subprocess.check_output(
+            [sys.executable, "-c", _READ_CONFIG], env=env))
+        self.assertFalse(second["loaded"])
+        self.assertEqual(second["lang"], first["lang"])
+        self.assertEqual(second["version"], first["version"])
+
+        # snapshot is outdated if a config file changed meanwhile
+        user_config = join(self.test_dir, "config", "mycroft", "mycroft.conf")
+        os.makedirs(dirname(user_config), exist_ok=True)
+        with open(user_config, "w") as f:
+            json.dump({"lang": "pt-pt"}, f)
+        third = json.loads(subprocess.check_output(
+            [sys.executable, "-c", _READ_CONFIG], env=env))
+        self.assertTrue(third["loaded"])
+        self.assertEqual(third["lang"], "pt-pt")
+        self.assertGreater(third["version"], second["version"])
+
+        # watching the config files does not load them
+        fourth = json.loads(subprocess.check_output(
+            [sys.executable, "-c", _WATCH_CONFIG], env=env))
+        self.assertEqual(fourth["loaded"], [])
+        self.assertEqual(fourth["lang"], "pt-pt")